@@ -104,11 +104,18 @@ DEFAULTS_APP = [
             'ylabel_widget_width':  (60, 70),
             'xaxis_widget_height':  (20, 40),
             'yaxis_widget_width':   (20, 40),
+            'section_cache_mb': 1024,  # memory budget of section data
         }),
     ('process_log',
         {
             'enable': True,
         }),
+    ('database',
+        {
+            'auto_vacuum': 'INCREMENTAL',
+            'vacuum_free_ratio': 0.25,
+            'vacuum_step_pages': 4096,
+        }),
     ('data_explorer',
         {
             'enable': True,
@@ -3,7 +3,7 @@
 """
 """
 
-from qtpy.QtCore import Qt
+from qtpy.QtCore import Qt, QTimer
 from qtpy.QtWidgets import (QLabel, QLineEdit, QRadioButton,
     QSplitter, QPushButton, QHBoxLayout, QVBoxLayout, QWidget, QSlider)
 
@@ -11,9 +11,13 @@ from ezcad.config.base import _
 from ezcad.widgets.ezdialog import EasyDialog
 from ezcad.utils.logger import logger
 from ezcad.utils.colorbar_gradients import Gradients as customGradients
-from ezcad.utils.plotting import set_gradient_alpha
+from ezcad.utils.plotting import set_gradient_alpha, update_visual_colormap
+from ezcad.utils.dirty_state import mark_dirty
+from ezcad.utils.property_stats import get_stats, histogram_curve
 from ezcad.widgets.histogram_lut_widget import HistogramLUTWidget
 
+PREVIEW_MS = 16  # at most one preview per frame at 60 Hz
+
 
 class ColorbarEditor(EasyDialog):
     NAME = _("Colorbar editor")
@@ -26,7 +30,10 @@ class ColorbarEditor(EasyDialog):
     "After zoom out, drag the region to move along the axis. <br>"
     "Right click the colorbar to select different colormap. <br>"
     "One of the four bars can be enabled by set Orientation. <br>"
-    "The bar widgets can be resized by the move the splitter. <br>")
+    "The bar widgets can be resized by the move the splitter. <br>"
+    "While dragging, the current viewer previews the colors; "
+    "they are saved to the object on release or Apply, "
+    "Cancel restores the colors of the viewer. <br>")
 
     def __init__(self, parent=None):
         EasyDialog.__init__(self, parent=parent, set_tree=True, set_db=True)
@@ -34,6 +41,13 @@ class ColorbarEditor(EasyDialog):
         self.dob = None
         self.clip_min = 0
         self.clip_max = 1
+        # Coalesce the drag events into one preview per frame.
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_MS)
+        self.preview_timer.timeout.connect(self.preview)
+        # id(visual) -> (visual, cmap, clim) before its first preview
+        self.previewed = {}
         self.setup_page()
 
     def setup_page(self):
@@ -147,6 +161,7 @@ class ColorbarEditor(EasyDialog):
         set_gradient_alpha(gradient, opacity)
         prop_name = self.prop_name
         self.dob.set_gradient(prop_name, gradient)
+        mark_dirty(self.dob, prop_name)
         self.dob.make_colormap(prop_name)
         self.dob.update_plots_by_prop()
 
@@ -171,11 +186,72 @@ class ColorbarEditor(EasyDialog):
 
             self.hlut_active.sigLevelChangeFinished.connect(self.level_changed)
             self.hlut_active.sigLevelChangeFinished.connect(self.apply)
+            self.hlut_active.sigLevelsChanged.connect(self.schedule_preview)
+            self.hlut_active.sigLookupTableChanged.connect(
+                self.schedule_preview)
             # self.hlut_active.sigLookupTableChanged.connect(self.apply)
 
             if self.dob is not None:
                 self.load_hlut()
 
+    def schedule_preview(self):
+        if self.dob is not None and not self.preview_timer.isActive():
+            self.preview_timer.start()
+
+    def preview_visuals(self):
+        """
+        -o- visuals : list, visuals of the object in the current viewer
+        """
+        mainwindow = getattr(self, 'mainwindow', None)
+        viewer = getattr(mainwindow, 'current_viewer', None)
+        if viewer is None or self.dob is None:
+            return []
+        owned = []
+        for attr in ('section_image', 'section_image3d', 'aline_image'):
+            for images in getattr(self.dob, attr, {}).values():
+                if viewer.name in images:
+                    owned.append(images[viewer.name])
+        return [v for v in viewer.canvas.visuals
+                if any(v is o for o in owned)]
+
+    def preview(self):
+        """
+        Show the dragged colors in the current viewer only, without
+        changing the object. Visuals colored on the CPU are left to apply.
+        """
+        prop_name = getattr(self, 'prop_name', None)
+        if self.dob is None or prop_name != self.dob.current_property:
+            return
+        clip = self.hlut_active.getLevels()
+        gradient = self.hlut_active.gradient.saveState()
+        set_gradient_alpha(gradient, self.opacity.value())
+        for visual in self.preview_visuals():
+            if id(visual) not in self.previewed and \
+                    hasattr(visual, 'cmap') and hasattr(visual, 'clim'):
+                self.previewed[id(visual)] = (visual, visual.cmap,
+                                              tuple(visual.clim))
+            update_visual_colormap(visual, gradient, clip)
+
+    def revert_preview(self):
+        """ Restore the colors of the visuals previewed since the last
+        apply """
+        self.preview_timer.stop()
+        for visual, cmap, clim in self.previewed.values():
+            if visual.cmap is not cmap:
+                visual.cmap = cmap
+            if tuple(visual.clim) != clim:
+                visual.clim = clim
+        self.previewed = {}
+
+    def reject(self):
+        self.revert_preview()
+        EasyDialog.reject(self)
+
+    def closeEvent(self, event):
+        # Cancel closes the dialog, Escape rejects it.
+        self.revert_preview()
+        EasyDialog.closeEvent(self, event)
+
     def level_changed(self):
         """
         Level is changed in the hlut by mouse dragging, now sync textbox.
@@ -196,6 +272,7 @@ class ColorbarEditor(EasyDialog):
         if self.dob is None:
             logger.warning('No data object is loaded yet')
             return
+        self.preview_timer.stop()
         self.clip_changed()
         prop_name = self.prop_name
         # save to dob for updating plots of the object
@@ -206,8 +283,10 @@ class ColorbarEditor(EasyDialog):
         opacity = self.opacity.value()
         set_gradient_alpha(gradient, opacity)
         self.dob.set_gradient(prop_name, gradient)
+        mark_dirty(self.dob, prop_name)
         self.dob.make_colormap(prop_name)
         self.dob.update_plots_by_prop()
+        self.previewed = {}  # the object has the previewed colors now
 
         # TODO handle points multiple properties
 
@@ -242,6 +321,7 @@ class ColorbarEditor(EasyDialog):
         self.load_hlut()
 
     def load_hlut(self):
+        self.revert_preview()
         prop_name = self.prop_name
         cg = self.dob.prop[prop_name]['colorGradient']
         if cg is not None:
@@ -250,6 +330,9 @@ class ColorbarEditor(EasyDialog):
         self.clip_min, self.clip_max = self.dob.prop[prop_name]['colorClip']
         self.hlut_active.setLevels(self.clip_min, self.clip_max)
 
+        stats = get_stats(self.dob.prop[prop_name])
+        self.hlut_active.setHistogram(*histogram_curve(stats))
+
         # Assume constant alpha, so use the first value
         alpha = cg['ticks'][0][1][3]
         self.opacity.setValue(alpha)
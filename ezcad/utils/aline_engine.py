@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Arbitrary-line (aline) section extraction from a cube.
+
+An aline is a polyline of vertexes on the survey. AlineEngine converts
+each segment once to fractional array positions along the cube iline and
+xline axes, with traces sampled at a fixed spacing, and caches the
+segment paths keyed by their end vertexes. All traces of the section are
+then gathered from the cube with one fancy-indexing operation, either
+the nearest trace or bilinear interpolation of the four neighbours.
+
+When a vertex is dragged only the two segments touching it get new keys,
+so the rest of the path comes from the cache and editing stays
+interactive on large cubes.
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+SEGMENT_CACHE_SIZE = 256
+METHODS = ('nearest', 'bilinear')
+
+
+def fill_dtype(dtype, fill):
+    """
+    -i- dtype : numpy dtype of the section
+    -i- fill : value of traces outside the cube
+    -o- dtype : dtype holding both, float for NaN in an integer section
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'fc':
+        return dtype
+    if np.isnan(fill):
+        return np.promote_types(dtype, np.float32)
+    if dtype.kind == 'b':
+        if fill not in (0, 1):
+            raise ValueError("Fill {} is not a boolean".format(fill))
+        return dtype
+    info = np.iinfo(dtype)
+    if fill != int(fill) or not info.min <= fill <= info.max:
+        raise ValueError("Fill {} does not fit in {}".format(fill, dtype))
+    return dtype
+
+
+class AlineEngine:
+    """Extract aline sections from one cube array"""
+    def __init__(self, cube, il_first=0, xl_first=0, il_step=1, xl_step=1,
+                 transform=None, spacing=1.0):
+        """
+        -i- cube : 3D array or memmap, (iline, xline, depth)
+        -i- il_first, xl_first : int, line number of the first iline/xline
+        -i- il_step, xl_step : int, line increment of the cube
+        -i- transform : SurveyTransform, needed for vertexes in xy
+        -i- spacing : float, trace spacing along the path, in array cells
+        """
+        self.cube = cube
+        self.origin = np.array([il_first, xl_first], dtype=np.float64)
+        self.step = np.array([il_step, xl_step], dtype=np.float64)
+        self.transform = transform
+        self.spacing = spacing
+        self._segments = OrderedDict()
+
+    def clear_cache(self):
+        self._segments.clear()
+
+    def to_index(self, vertexes, unit='ln'):
+        """
+        -i- vertexes : array, m by 2, [ilno, xlno] or [x, y]
+        -i- unit : string, 'ln' line numbers or 'xy' coordinates
+        -o- index : array, m by 2 fractional array positions
+        """
+        vertexes = np.asarray(vertexes, dtype=np.float64)
+        if unit == 'xy':
+            if self.transform is None:
+                raise ValueError("Need a survey transform for xy vertexes")
+            vertexes = self.transform.to_ln(vertexes, rounding=None)
+        elif unit != 'ln':
+            raise ValueError("Unknown unit {}".format(unit))
+        return (vertexes - self.origin) / self.step
+
+    def _segment(self, p0, p1, last):
+        """ Fractional positions of the traces of segment p0 to p1 """
+        key = (tuple(p0), tuple(p1), self.spacing, last)
+        path = self._segments.get(key)
+        if path is not None:
+            self._segments.move_to_end(key)
+            return path
+        length = float(np.hypot(*(p1 - p0)))
+        ntrace = max(1, int(np.ceil(length / self.spacing)))
+        t = np.arange(ntrace + (1 if last else 0)) / ntrace
+        path = p0 + t[:, np.newaxis] * (p1 - p0)
+        path.setflags(write=False)
+        self._segments[key] = path
+        if len(self._segments) > SEGMENT_CACHE_SIZE:
+            self._segments.popitem(last=False)
+        return path
+
+    def path(self, vertexes, unit='ln'):
+        """
+        -i- vertexes : array, m by 2, the polyline
+        -i- unit : string, 'ln' or 'xy'
+        -o- positions : array, n by 2 fractional positions of the traces
+        -o- distance : array, n, distance along the path in array cells
+        """
+        index = self.to_index(vertexes, unit)
+        if len(index) < 2:
+            raise ValueError("Aline needs at least two vertexes")
+        last = len(index) - 2
+        parts = [self._segment(index[k], index[k+1], k == last)
+                 for k in range(len(index) - 1)]
+        positions = np.concatenate(parts)
+        steps = np.hypot(*np.diff(positions, axis=0).T)
+        distance = np.concatenate(([0.0], np.cumsum(steps)))
+        return positions, distance
+
+    def extract(self, vertexes, unit='ln', method='nearest', fill=np.nan):
+        """
+        -i- vertexes : array, m by 2, the polyline
+        -i- unit : string, 'ln' or 'xy'
+        -i- method : string, 'nearest' or 'bilinear'
+        -i- fill : value of traces outside the cube; with NaN the section
+            of an integer cube is promoted to float, whether or not the
+            path leaves the cube
+        -o- section : 2D array, (number of traces, number of samples)
+        -o- positions : array, fractional positions of the traces
+        -o- distance : array, distance along the path in array cells
+        """
+        if method not in METHODS:
+            raise ValueError("Unknown method {}".format(method))
+        positions, distance = self.path(vertexes, unit)
+        ni, nj = self.cube.shape[:2]
+        i, j = positions[:, 0], positions[:, 1]
+        if method == 'nearest':
+            ii = np.rint(i).astype(np.intp)
+            jj = np.rint(j).astype(np.intp)
+            inside = (ii >= 0) & (ii < ni) & (jj >= 0) & (jj < nj)
+            section = self.cube[ii[inside], jj[inside]]
+        else:
+            inside = (i >= 0) & (i <= ni - 1) & (j >= 0) & (j <= nj - 1)
+            i, j = i[inside], j[inside]
+            i0 = np.minimum(np.floor(i).astype(np.intp), max(ni - 2, 0))
+            j0 = np.minimum(np.floor(j).astype(np.intp), max(nj - 2, 0))
+            i1 = np.minimum(i0 + 1, ni - 1)
+            j1 = np.minimum(j0 + 1, nj - 1)
+            fi = (i - i0)[:, np.newaxis]
+            fj = (j - j0)[:, np.newaxis]
+            section = (self.cube[i0, j0] * ((1 - fi) * (1 - fj)) +
+                       self.cube[i1, j0] * (fi * (1 - fj)) +
+                       self.cube[i0, j1] * ((1 - fi) * fj) +
+                       self.cube[i1, j1] * (fi * fj))
+        # The dtype must not depend on whether the path leaves the cube.
+        dtype = fill_dtype(section.dtype, fill)
+        if np.all(inside):
+            return section.astype(dtype, copy=False), positions, distance
+        out = np.full((len(positions),) + self.cube.shape[2:], fill,
+                      dtype=dtype)
+        out[inside] = section
+        return out, positions, distance
+
+
+def main():
+    cube = np.random.rand(200, 300, 100).astype('float32')
+    engine = AlineEngine(cube, il_first=100, xl_first=1000)
+    vertexes = [[100, 1000], [250, 1150], [299, 1299]]
+    section, positions, distance = engine.extract(vertexes)
+    print('Nearest', section.shape, 'length', distance[-1])
+    vertexes[1] = [240, 1160]  # drag the middle vertex
+    section, positions, distance = engine.extract(vertexes,
+                                                  method='bilinear')
+    print('Bilinear', section.shape, 'cached segments',
+          len(engine._segments))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Out-of-band storage of large arrays in .npy files next to the database.
+
+A BLOB is limited to SQLITE_LIMIT_LENGTH and has to be read in full, so
+huge properties are split and concatenated in memory. In the sidecar
+mode the array is written to an .npy file in a directory next to the
+project database, which keeps only a reference row (path, dtype, shape,
+checksum). Loading returns an np.memmap, so a cube larger than physical
+memory can be opened and sliced directly. Saving an array that is
+already mapped read-write from its sidecar file is a flush and fsync.
+
+Inside a transaction, pass a PendingSidecars to save_sidecar and
+remove_sidecar: new files are written under temporary names and only
+renamed, and removed files only deleted, by its commit() after the
+database COMMIT, so a rollback leaves the rows and files matching.
+"""
+
+import os
+import mmap
+import hashlib
+import tempfile
+import numpy as np
+from ezcad.utils.envars import SQLITE_LIMIT_LENGTH
+from ezcad.utils.logger import logger
+
+SIDECAR_SUFFIX = '_arrays'
+
+
+def use_sidecar(array, threshold=SQLITE_LIMIT_LENGTH):
+    """ Return True if the array is big enough for the sidecar mode """
+    return array.nbytes >= threshold
+
+
+def sidecar_dir(dbfile):
+    """
+    -i- dbfile : string, project database file, e.g. /data/test.ezd
+    -o- path : string, the sidecar directory, e.g. /data/test_arrays
+    """
+    return os.path.splitext(dbfile)[0] + SIDECAR_SUFFIX
+
+
+def create_sidecar_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS array_sidecar
+        (object_name TEXT, prop_name TEXT, path TEXT, dtype TEXT,
+        shape TEXT, checksum TEXT, PRIMARY KEY (object_name, prop_name))
+        ''')
+
+
+def array_checksum(array, block=1 << 26):
+    """
+    -i- array : array, may be a memmap
+    -i- block : int, approximate bytes hashed at a time
+    -o- checksum : string, BLAKE2b hex digest of the C-ordered data
+    """
+    h = hashlib.blake2b(digest_size=20)
+    if array.ndim == 0 or array.shape[0] == 0:
+        h.update(np.ascontiguousarray(array).tobytes())
+        return h.hexdigest()
+    rowBytes = max(1, array.nbytes // array.shape[0])
+    step = max(1, block // rowBytes)
+    for start in range(0, array.shape[0], step):
+        part = np.ascontiguousarray(array[start:start+step])
+        h.update(memoryview(part.reshape(-1).view(np.uint8)))
+    return h.hexdigest()
+
+
+def sidecar_name(object_name, prop_name):
+    """
+    -o- name : string, file name of the sidecar, from a hash of the key,
+        so names with dots or path separators cannot collide or escape
+        the sidecar directory
+    """
+    key = '{}\0{}'.format(object_name, prop_name).encode('utf-8')
+    return hashlib.blake2b(key, digest_size=16).hexdigest() + '.npy'
+
+
+def maps_whole_file(array, path):
+    """
+    -i- array : array, may be a memmap
+    -i- path : string, .npy file
+    -o- mapped : bool, True if array is the memmap of the whole file as
+        returned by np.load, not a slice or another view of it
+    """
+    if not isinstance(array, np.memmap) or array.filename is None or \
+            os.path.abspath(array.filename) != os.path.abspath(path):
+        return False
+    if not isinstance(array.base, mmap.mmap) or \
+            not array.flags.c_contiguous:
+        return False
+    with open(path, 'rb') as fp:
+        version = np.lib.format.read_magic(fp)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(fp)
+        else:
+            header = np.lib.format.read_array_header_2_0(fp)
+    shape, fortran, dtype = header
+    return tuple(shape) == array.shape and dtype == array.dtype and \
+        not fortran
+
+
+def _fsync_dir(path):
+    if os.name == 'nt':
+        return  # directories cannot be opened for fsync on Windows
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class PendingSidecars:
+    """Sidecar file changes applied after the database commit"""
+    def __init__(self):
+        self._ops = []  # (tmp, path) renames and (None, path) removals
+
+    def __len__(self):
+        return len(self._ops)
+
+    def replace(self, tmp, path):
+        self._ops.append((tmp, path))
+
+    def remove(self, path):
+        self._ops.append((None, path))
+
+    def commit(self):
+        """ Call after the COMMIT of the rows """
+        folders = set()
+        for tmp, path in self._ops:
+            if tmp is not None:
+                os.replace(tmp, path)
+                folders.add(os.path.dirname(path))
+            elif os.path.isfile(path):
+                os.remove(path)
+        for folder in folders:
+            _fsync_dir(folder)
+        self._ops = []
+
+    def rollback(self):
+        """ Call after a ROLLBACK, drops the new files """
+        for tmp, path in self._ops:
+            if tmp is not None and os.path.isfile(tmp):
+                os.remove(tmp)
+        self._ops = []
+
+
+def save_sidecar(cursor, dbfile, object_name, prop_name, array,
+                 checksum=None, pending=None):
+    """
+    -i- cursor : sqlite cursor of the project database
+    -i- dbfile : string, project database file
+    -i- object_name : string
+    -i- prop_name : string
+    -i- array : array, or memmap returned by load_sidecar
+    -i- checksum : bool, compute the checksum of the data, which reads
+        all of it; default only when the file is written, not when a
+        mapped array is flushed
+    -i- pending : PendingSidecars, the file is put in place by its
+        commit(); default at once
+    """
+    folder = sidecar_dir(dbfile)
+    os.makedirs(folder, exist_ok=True)
+    name = sidecar_name(object_name, prop_name)
+    path = os.path.join(folder, name)
+
+    # A copy-on-write or read-only map does not write to the file.
+    mapped = maps_whole_file(array, path) and array.mode == 'r+'
+    if checksum is None:
+        checksum = not mapped
+    if mapped:
+        # Edited in place, only the dirty pages need to reach the disk.
+        array.flush()
+        with open(path, 'rb+') as fp:
+            os.fsync(fp.fileno())
+    else:
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', prefix=name, dir=folder)
+        with os.fdopen(fd, 'wb') as fp:
+            np.lib.format.write_array(fp, array, allow_pickle=False)
+            fp.flush()
+            os.fsync(fp.fileno())
+        own = pending is None
+        if own:
+            pending = PendingSidecars()
+        pending.replace(tmp, path)
+        if own:
+            pending.commit()
+
+    digest = array_checksum(array) if checksum else None
+    values = (object_name, prop_name, name, array.dtype.str,
+              ','.join(str(n) for n in array.shape), digest)
+    cursor.execute("INSERT OR REPLACE INTO array_sidecar VALUES "
+                   "(?,?,?,?,?,?)", values)
+    logger.info('Saved {} {} to {}'.format(object_name, prop_name, path))
+
+
+def has_sidecar(cursor, object_name, prop_name):
+    cursor.execute("SELECT count(*) FROM array_sidecar WHERE "
+                   "object_name = ? AND prop_name = ?",
+                   (object_name, prop_name))
+    return cursor.fetchone()[0] > 0
+
+
+def load_sidecar(cursor, dbfile, object_name, prop_name, mode='r+',
+                 verify=False):
+    """
+    -i- mode : string, memmap mode, 'r' read-only, 'r+' read-write,
+        'c' copy-on-write.
+    -i- verify : bool, check the data against the saved checksum, which
+        reads the whole file.
+    -o- array : np.memmap
+    """
+    cursor.execute("SELECT path, dtype, shape, checksum FROM array_sidecar "
+                   "WHERE object_name = ? AND prop_name = ?",
+                   (object_name, prop_name))
+    row = cursor.fetchone()
+    if row is None:
+        raise KeyError("No sidecar for {} {}".format(object_name, prop_name))
+    name, dtype, shape, digest = row
+    path = os.path.join(sidecar_dir(dbfile), name)
+    array = np.load(path, mmap_mode=mode, allow_pickle=False)
+    shape = tuple(int(n) for n in shape.split(',') if len(n) > 0)
+    if array.dtype != np.dtype(dtype) or array.shape != shape:
+        raise ValueError("Sidecar {} does not match the database".format(
+            path))
+    if verify and digest is not None and array_checksum(array) != digest:
+        raise ValueError("Sidecar {} checksum is wrong".format(path))
+    return array
+
+
+def remove_sidecar(cursor, dbfile, object_name, prop_name=None,
+                   pending=None):
+    """
+    -i- pending : PendingSidecars, the files are deleted by its commit();
+        default at once
+    """
+    if prop_name is None:
+        key = (object_name,)
+        where = "WHERE object_name = ?"
+    else:
+        key = (object_name, prop_name)
+        where = "WHERE object_name = ? AND prop_name = ?"
+    cursor.execute("SELECT path FROM array_sidecar " + where, key)
+    names = [row[0] for row in cursor.fetchall()]
+    cursor.execute("DELETE FROM array_sidecar " + where, key)
+    own = pending is None
+    if own:
+        pending = PendingSidecars()
+    for name in names:
+        pending.remove(os.path.join(sidecar_dir(dbfile), name))
+    if own:
+        pending.commit()
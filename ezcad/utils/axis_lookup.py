@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Batch nearest lookup on an axis, replacing convert_grid.find_nearest.
+
+find_nearest scans the whole array for each value. AxisLookup inspects
+the axis once: a regular axis (constant step) is indexed by arithmetic,
+a monotonic axis by np.searchsorted, and any other axis by searchsorted
+on a sorted copy with the sort permutation. find_nearest_many keeps the
+lookups of recently used axes, so calling it repeatedly on the same depth
+axis or line number array does not inspect the axis again. A cached
+lookup holds its own copy of the axis: the entry goes away with the
+array, and an array edited in place no longer equals the copy, so the
+lookup is made again.
+
+Like find_nearest, a value halfway between two elements snaps to the one
+with the lower index.
+"""
+
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+REGULAR, ASCENDING, DESCENDING, UNSORTED = \
+    'regular', 'ascending', 'descending', 'unsorted'
+
+_CACHE_SIZE = 16
+_cache = OrderedDict()
+
+
+class AxisLookup:
+    """Nearest element lookup on one 1D axis"""
+    def __init__(self, axis, rtol=1e-9):
+        """
+        -i- axis : 1D array
+        -i- rtol : float, relative tolerance of the step of a regular axis
+        """
+        axis = np.asarray(axis)
+        if axis.ndim != 1 or len(axis) == 0:
+            raise ValueError("Axis must be a non-empty 1D array")
+        self.axis = axis
+        self.perm = None
+        self.sorted = axis
+        self.kind = UNSORTED
+        if len(axis) == 1:
+            self.kind = ASCENDING
+            return
+        diff = np.diff(axis)
+        if np.all(diff > 0):
+            self.kind = ASCENDING
+        elif np.all(diff < 0):
+            self.kind = DESCENDING
+        if self.kind != UNSORTED:
+            self.start = float(axis[0])
+            self.step = float(axis[-1] - axis[0]) / (len(axis) - 1)
+            if np.allclose(diff, self.step, rtol=rtol, atol=0):
+                self.kind = REGULAR
+        if self.kind == DESCENDING:
+            self.sorted = axis[::-1]
+        elif self.kind == UNSORTED:
+            self.perm = np.argsort(axis, kind='stable')
+            self.sorted = axis[self.perm]
+
+    def _search(self, values):
+        """ Index in self.sorted of the nearest element """
+        s = self.sorted
+        right = np.clip(np.searchsorted(s, values, side='left'),
+                        1, len(s) - 1)
+        left = right - 1
+        dleft = values - s[left]
+        dright = s[right] - values
+        if self.kind == DESCENDING:
+            # Lower original index is the right one in the reversed axis.
+            return np.where(dleft < dright, left, right)
+        if self.kind != UNSORTED:
+            return np.where(dleft <= dright, left, right)
+        # First of equal values, which has the lowest original index; a
+        # tie goes to the lower original index, as with argmin.
+        left = self.perm[np.searchsorted(s, s[left])]
+        right = self.perm[np.searchsorted(s, s[right])]
+        tie = dleft == dright
+        return np.where(tie, np.minimum(left, right),
+                        np.where(dleft < dright, left, right))
+
+    def lookup(self, values):
+        """
+        -i- values : scalar or array, query values
+        -o- index : int array, index of the nearest element of the axis
+        -o- snapped : array, the nearest elements, i.e. axis[index]
+        """
+        values = np.asarray(values, dtype=np.result_type(self.axis, float))
+        n = len(self.axis)
+        if n == 1:
+            index = np.zeros(values.shape, dtype=np.intp)
+        elif self.kind == REGULAR:
+            x = (values - self.start) / self.step
+            index = np.clip(np.ceil(x - 0.5), 0, n - 1).astype(np.intp)
+        else:
+            index = self._search(values)
+            if self.kind == DESCENDING:
+                index = (n - 1) - index
+        return index, self.axis[index]
+
+
+def _forget(key, ref):
+    item = _cache.get(key)
+    if item is not None and item[0] is ref:
+        _cache.pop(key, None)
+
+
+def get_lookup(axis):
+    """
+    -i- axis : 1D array
+    -o- lookup : AxisLookup, cached for the same array object with the
+        same values
+    """
+    key = id(axis)
+    item = _cache.get(key)
+    if item is not None and item[0]() is axis and \
+            np.array_equal(item[1].axis, axis):
+        _cache.move_to_end(key)
+        return item[1]
+    try:
+        ref = weakref.ref(axis, lambda r, key=key: _forget(key, r))
+    except TypeError:
+        return AxisLookup(axis)  # e.g. a list, cannot be cached by identity
+    # The copy keeps the cache from holding the array alive.
+    lookup = AxisLookup(np.array(axis))
+    _cache[key] = (ref, lookup)
+    if len(_cache) > _CACHE_SIZE:
+        _cache.popitem(last=False)
+    return lookup
+
+
+def clear_lookup_cache():
+    _cache.clear()
+
+
+def find_nearest_many(axis, values):
+    """
+    -i- axis : 1D array, e.g. depth axis or line numbers
+    -i- values : scalar or array, query values
+    -o- index : int array, index of the nearest element of the axis
+    -o- snapped : array, the nearest elements, i.e. axis[index]
+    """
+    return get_lookup(axis).lookup(values)
+
+
+def main():
+    axis = np.arange(0, 4000, 4.0)
+    values = np.random.uniform(-10, 4010, 10)
+    index, snapped = find_nearest_many(axis, values)
+    for v, i, s in zip(values, index, snapped):
+        assert s == axis[np.abs(axis - v).argmin()]
+        print('{:.2f} -> axis[{}] = {}'.format(v, i, s))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Brick-tiled storage of 3D arrays for random-access section reads.
+
+The default storage splits an array along the first axis by byte size,
+so reading one section needs the whole cube. In the brick layout the
+cube is cut into fixed-size bricks, e.g. 64x64x64, stored one per row
+keyed by the brick index (bi, bj, bk). A section or sub-volume is read by
+fetching only the bricks it intersects.
+
+The axes follow the cube array, i.e. axis 0 is iline, 1 is xline and
+2 is depth, and section numbers are array indexes along the axis.
+"""
+
+from collections import OrderedDict
+import numpy as np
+from ezcad.utils.envars import SECTION_TYPES
+from ezcad.utils.sqlite_array import decode_array
+from ezcad.utils.logger import logger
+
+BRICK_SHAPE = (64, 64, 64)
+
+
+def create_brick_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS brick_info
+        (object_name TEXT, prop_name TEXT, ni INTEGER, nj INTEGER,
+        nk INTEGER, bni INTEGER, bnj INTEGER, bnk INTEGER, dtype TEXT,
+        PRIMARY KEY (object_name, prop_name))
+        ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS brick_data
+        (object_name TEXT, prop_name TEXT, bi INTEGER, bj INTEGER,
+        bk INTEGER, arr ARRAY,
+        PRIMARY KEY (object_name, prop_name, bi, bj, bk))
+        ''')
+
+
+def remove_bricks(cursor, object_name, prop_name=None):
+    if prop_name is None:
+        key = (object_name,)
+        where = "WHERE object_name = ?"
+    else:
+        key = (object_name, prop_name)
+        where = "WHERE object_name = ? AND prop_name = ?"
+    cursor.execute("DELETE FROM brick_info " + where, key)
+    cursor.execute("DELETE FROM brick_data " + where, key)
+
+
+def iter_bricks(array, brick=BRICK_SHAPE):
+    """
+    -i- array : 3D array
+    -i- brick : tuple, brick shape
+    Yield (bi, bj, bk, view) of each brick; edge bricks are smaller.
+    """
+    ni, nj, nk = array.shape
+    bni, bnj, bnk = brick
+    for bi, i0 in enumerate(range(0, ni, bni)):
+        for bj, j0 in enumerate(range(0, nj, bnj)):
+            for bk, k0 in enumerate(range(0, nk, bnk)):
+                yield (bi, bj, bk,
+                       array[i0:i0+bni, j0:j0+bnj, k0:k0+bnk])
+
+
+def write_bricks(cursor, object_name, prop_name, array, brick=BRICK_SHAPE):
+    """
+    -i- cursor : sqlite cursor
+    -i- object_name : string, cube name
+    -i- prop_name : string, property name
+    -i- array : 3D array
+    -i- brick : tuple, brick shape
+    """
+    if array.ndim != 3:
+        raise ValueError("Brick storage needs a 3D array")
+    remove_bricks(cursor, object_name, prop_name)
+    ni, nj, nk = array.shape
+    bni, bnj, bnk = brick
+    cursor.execute("INSERT INTO brick_info VALUES (?,?,?,?,?,?,?,?,?)",
+                   (object_name, prop_name, ni, nj, nk, bni, bnj, bnk,
+                    array.dtype.str))
+    rows = ((object_name, prop_name, bi, bj, bk, np.ascontiguousarray(b))
+            for bi, bj, bk, b in iter_bricks(array, brick))
+    cursor.executemany("INSERT INTO brick_data VALUES (?,?,?,?,?,?)", rows)
+    logger.info('Saved {} {} in bricks of {}'.format(
+        object_name, prop_name, brick))
+
+
+def has_bricks(cursor, object_name, prop_name):
+    cursor.execute("SELECT count(*) FROM brick_info WHERE object_name = ? "
+                   "AND prop_name = ?", (object_name, prop_name))
+    return cursor.fetchone()[0] > 0
+
+
+class BrickReader:
+    """Read sections and sub-volumes from the brick layout"""
+    def __init__(self, cursor, object_name, prop_name, cache_size=64):
+        """
+        -i- cursor : sqlite cursor
+        -i- object_name : string, cube name
+        -i- prop_name : string, property name
+        -i- cache_size : int, number of decoded bricks kept in memory.
+            Neighbouring sections share bricks, so scrolling mostly hits
+            the cache.
+        """
+        self.cursor = cursor
+        self.key = (object_name, prop_name)
+        cursor.execute("SELECT ni, nj, nk, bni, bnj, bnk, dtype FROM "
+                       "brick_info WHERE object_name = ? AND prop_name = ?",
+                       self.key)
+        row = cursor.fetchone()
+        if row is None:
+            raise ValueError("No brick is found for {} {}".format(
+                object_name, prop_name))
+        ni, nj, nk, bni, bnj, bnk, dtype = row
+        self.shape = (ni, nj, nk)
+        self.brick = (bni, bnj, bnk)
+        self.dtype = np.dtype(dtype)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def _fetch(self, blo, bhi):
+        """ Fetch bricks in the index box [blo, bhi], cached first. Raise
+        ValueError if one is not stored, rather than leave its cells of
+        the output uninitialized. """
+        wanted = [(bi, bj, bk)
+                  for bi in range(blo[0], bhi[0] + 1)
+                  for bj in range(blo[1], bhi[1] + 1)
+                  for bk in range(blo[2], bhi[2] + 1)]
+        bricks = {}
+        for b in wanted:
+            if b in self._cache:
+                self._cache.move_to_end(b)
+                bricks[b] = self._cache[b]
+        if len(bricks) < len(wanted):
+            params = self.key + (blo[0], bhi[0], blo[1], bhi[1],
+                                 blo[2], bhi[2])
+            self.cursor.execute(
+                "SELECT bi, bj, bk, CAST(arr AS BLOB) FROM brick_data "
+                "WHERE object_name = ? AND prop_name = ? "
+                "AND bi BETWEEN ? AND ? AND bj BETWEEN ? AND ? "
+                "AND bk BETWEEN ? AND ?", params)
+            for bi, bj, bk, blob in self.cursor:
+                b = (bi, bj, bk)
+                if b in bricks:
+                    continue
+                bricks[b] = decode_array(blob)
+                self._cache[b] = bricks[b]
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        if len(bricks) < len(wanted):
+            missing = [b for b in wanted if b not in bricks]
+            raise ValueError("Bricks {} are missing for {} {}".format(
+                missing[:4], *self.key))
+        return bricks
+
+    def subvolume(self, islice=slice(None), jslice=slice(None),
+                  kslice=slice(None)):
+        """
+        -i- islice, jslice, kslice : slice, with step 1 or None
+        -o- out : 3D array, the sub-volume
+        """
+        ranges = []
+        for s, n in zip((islice, jslice, kslice), self.shape):
+            start, stop, step = s.indices(n)
+            if step != 1:
+                raise ValueError("Sub-volume slice step must be 1")
+            ranges.append((start, max(start, stop)))
+        out = np.empty([hi - lo for lo, hi in ranges], dtype=self.dtype)
+        if out.size == 0:
+            return out
+        blo = [lo // b for (lo, hi), b in zip(ranges, self.brick)]
+        bhi = [(hi - 1) // b for (lo, hi), b in zip(ranges, self.brick)]
+        bricks = self._fetch(blo, bhi)
+        for (bi, bj, bk), data in bricks.items():
+            origin = (bi * self.brick[0], bj * self.brick[1],
+                      bk * self.brick[2])
+            src, dst = [], []
+            for o, n, (lo, hi) in zip(origin, data.shape, ranges):
+                a = max(lo, o)
+                z = min(hi, o + n)
+                src.append(slice(a - o, z - o))
+                dst.append(slice(a - lo, z - lo))
+            out[tuple(dst)] = data[tuple(src)]
+        return out
+
+    def section(self, section_type, index):
+        """
+        -i- section_type : string, iline, xline or depth
+        -i- index : int, array index along the section axis
+        -o- out : 2D array
+        """
+        if section_type not in SECTION_TYPES:
+            raise ValueError("Unknown section type {}".format(section_type))
+        axis = SECTION_TYPES.index(section_type)
+        if not 0 <= index < self.shape[axis]:
+            raise IndexError("Section index {} is out of range".format(index))
+        slices = [slice(None)] * 3
+        slices[axis] = slice(index, index + 1)
+        out = self.subvolume(*slices)
+        return out.reshape([n for i, n in enumerate(out.shape) if i != axis])
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Content-addressed storage of array chunks with reference counts.
+
+Copying an object used to write a second copy of every chunk of its
+arrays. Here a chunk is stored once in chunk_blob, keyed by the BLAKE2b
+hash of its encoded bytes (the codec header included, so equal bytes of
+a different dtype or shape are different chunks), together with the
+number of references. An array is a list of hashes in chunk_ref. Copying
+an object or saving an array equal to an existing one only adds rows to
+chunk_ref; removing deletes a chunk when its last reference is gone.
+"""
+
+import hashlib
+import numpy as np
+from ezcad.utils.functions import iter_split_array
+from ezcad.utils.envars import SQLITE_LIMIT_LENGTH
+from ezcad.utils.sqlite_array import adapt_array, decode_array, peek_header
+from ezcad.utils.sqlite_chunks import iter_blob_heads
+
+
+def create_chunk_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chunk_blob
+        (hash TEXT PRIMARY KEY, refcount INTEGER, nbytes INTEGER, data BLOB)
+        ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chunk_ref
+        (object_name TEXT, prop_name TEXT, chunkID INTEGER, hash TEXT,
+        PRIMARY KEY (object_name, prop_name, chunkID))
+        ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS chunk_ref_hash "
+                   "ON chunk_ref (hash)")
+
+
+def chunk_hash(blob):
+    """
+    -i- blob : bytes-like, encoded chunk
+    -o- hash : string, BLAKE2b hex digest
+    """
+    return hashlib.blake2b(blob, digest_size=32).hexdigest()
+
+
+def _add_chunk(cursor, blob):
+    """ Return the hash and True if the chunk is new """
+    digest = chunk_hash(blob)
+    cursor.execute("UPDATE chunk_blob SET refcount = refcount + 1 "
+                   "WHERE hash = ?", (digest,))
+    new = cursor.rowcount == 0
+    if new:
+        cursor.execute("INSERT INTO chunk_blob VALUES (?,1,?,?)",
+                       (digest, len(blob), blob))
+    return digest, new
+
+
+def _release_refs(cursor, where, key):
+    """ Decrement the chunks of the selected refs, delete unused ones """
+    cursor.execute("SELECT hash, count(*) FROM chunk_ref " + where +
+                   " GROUP BY hash", key)
+    counts = cursor.fetchall()
+    cursor.execute("DELETE FROM chunk_ref " + where, key)
+    cursor.executemany("UPDATE chunk_blob SET refcount = refcount - ? "
+                       "WHERE hash = ?", [(n, h) for h, n in counts])
+    cursor.execute("DELETE FROM chunk_blob WHERE refcount <= 0")
+
+
+def remove_array(cursor, object_name, prop_name=None):
+    """ Remove the refs of a property, or of all properties of an object """
+    if prop_name is None:
+        _release_refs(cursor, "WHERE object_name = ?", (object_name,))
+    else:
+        _release_refs(cursor, "WHERE object_name = ? AND prop_name = ?",
+                      (object_name, prop_name))
+
+
+def store_array(cursor, object_name, prop_name, array,
+                byteLimit=SQLITE_LIMIT_LENGTH):
+    """
+    -i- cursor : sqlite cursor
+    -i- object_name : string
+    -i- prop_name : string
+    -i- array : array, split in chunks like DBSQLite does, a 0-d array
+        is one chunk
+    -o- nnew : int, number of chunks which were not stored yet
+    The new chunks are referenced before the old refs are released, so
+    saving an unchanged array writes no chunk.
+    """
+    nnew = 0
+    digests = []
+    for chunk in iter_split_array(array, byteLimit):
+        digest, new = _add_chunk(cursor, adapt_array(chunk))
+        nnew += new
+        digests.append(digest)
+    remove_array(cursor, object_name, prop_name)
+    cursor.executemany("INSERT INTO chunk_ref VALUES (?,?,?,?)",
+                       [(object_name, prop_name, i + 1, digest)
+                        for i, digest in enumerate(digests)])
+    return nnew
+
+
+def copy_array(cursor, object_name, new_name, prop_name=None):
+    """
+    -i- object_name : string, source object
+    -i- new_name : string, the copy
+    -i- prop_name : string, default all properties of the object
+    No chunk data is read or written, only refs are added.
+    """
+    if prop_name is None:
+        where, key = "WHERE object_name = ?", (object_name,)
+    else:
+        where = "WHERE object_name = ? AND prop_name = ?"
+        key = (object_name, prop_name)
+    cursor.execute("SELECT prop_name, chunkID, hash FROM chunk_ref " + where,
+                   key)
+    rows = [(new_name,) + tuple(r) for r in cursor.fetchall()]
+    # Bump the counts first, the old refs of the copy may share chunks.
+    cursor.executemany("UPDATE chunk_blob SET refcount = refcount + 1 "
+                       "WHERE hash = ?", [(r[3],) for r in rows])
+    remove_array(cursor, new_name, prop_name)
+    cursor.executemany("INSERT INTO chunk_ref VALUES (?,?,?,?)", rows)
+
+
+def load_array(cursor, object_name, prop_name):
+    """
+    -o- array : array, the chunks concatenated along the first axis
+    The output is preallocated from the chunk headers and filled one
+    chunk at a time, as sqlite_chunks.cat_array does.
+    """
+    key = (object_name, prop_name)
+    # A left join keeps refs whose chunk is missing, so they are detected.
+    join = ("FROM chunk_ref r LEFT JOIN chunk_blob b ON r.hash = b.hash "
+            "WHERE r.object_name = ? AND r.prop_name = ? ORDER BY r.chunkID")
+    rows = list(iter_blob_heads(cursor, 'chunk_blob', 'data',
+                                "SELECT r.chunkID, {} " + join, key,
+                                prefix='b.'))
+    heads = []
+    for i, (chunkID, head) in enumerate(rows):
+        if chunkID != i + 1:
+            raise ValueError("Chunk order is wrong for {} {}".format(*key))
+        if head is None:
+            raise ValueError("Chunk {} is missing for {} {}".format(
+                chunkID, *key))
+        heads.append(peek_header(head))
+    if len(heads) == 0:
+        raise ValueError("No chunk is found for {} {}".format(*key))
+    dtype = heads[0][0]
+    shapes = [tuple(shape) for d, shape in heads]
+    if len(shapes) == 1:
+        shape = shapes[0]
+    else:
+        for d, s in heads[1:]:
+            if d != dtype or tuple(s[1:]) != shapes[0][1:]:
+                raise ValueError("Chunks have different shapes")
+        shape = (sum(s[0] for s in shapes),) + shapes[0][1:]
+    out = np.empty(shape, dtype=dtype)
+    cursor.execute("SELECT b.data " + join, key)
+    start = 0
+    for blob, in cursor:
+        chunk = decode_array(blob, copy=False)
+        if chunk.ndim == 0:
+            out[...] = chunk
+            continue
+        stop = start + chunk.shape[0]
+        out[start:stop] = chunk
+        start = stop
+    if len(shape) > 0 and start != shape[0]:
+        raise ValueError("Chunks do not fill the shape of {} {}".format(*key))
+    return out
+
+
+def storage_stats(cursor):
+    """
+    -o- stats : dict, stored_bytes on disk and logical_bytes of all refs
+    """
+    cursor.execute("SELECT count(*), coalesce(sum(nbytes), 0), "
+                   "coalesce(sum(nbytes * refcount), 0) FROM chunk_blob")
+    nchunk, stored, logical = cursor.fetchone()
+    return {'chunks': nchunk, 'stored_bytes': stored,
+            'logical_bytes': logical}
@@ -8,6 +8,7 @@ import os
 from math import sqrt
 import numpy as np
 from ezcad.utils.convert_grid import get_step, xy2ln, ln2xy
+from ezcad.utils.survey_transform import get_transform
 
 
 def get_sgmt_from_parm(dict_parm, p1ilno=0, p1xlno=0, ilstep=12.5, xlstep=12.5):
@@ -79,7 +80,7 @@ def get_vxyz_from_vidx(dict_vidx, survey):
     points_ln = np.array([[IL_FRST, XL_FRST],
                           [IL_FRST, XL_LAST],
                           [IL_LAST, XL_FRST]])
-    points_xy = ln2xy(points_ln, survey=survey)
+    points_xy = get_transform(survey).to_xy(points_ln)
 
     AXIS_ORX, AXIS_ORY = points_xy[0]
     AXIS_XLX, AXIS_XLY = points_xy[1]
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Free-space accounting and vacuum policy of the project database.
+
+A full VACUUM rewrites the whole file and needs as much again in the
+temporary directory, which on a 50 GB project is too slow to run at
+every save. New projects are created with auto_vacuum=INCREMENTAL, so
+free pages can be returned to the file system a few at a time with
+PRAGMA incremental_vacuum. A save reclaims space only when the free
+ratio is above the threshold; the full VACUUM runs on explicit request.
+"""
+
+from ezcad.utils.logger import logger
+
+AUTO_VACUUM_MODES = {0: 'NONE', 1: 'FULL', 2: 'INCREMENTAL'}
+
+
+def get_option(option, default):
+    """ Option from the database section of the config """
+    try:
+        from ezcad.config.main import CONF
+        return CONF.get('database', option)
+    except Exception:
+        return default
+
+
+def auto_vacuum_mode(cursor):
+    cursor.execute("PRAGMA auto_vacuum")
+    return AUTO_VACUUM_MODES.get(cursor.fetchone()[0], 'NONE')
+
+
+def set_auto_vacuum(cursor, mode=None):
+    """
+    -i- cursor : sqlite cursor
+    -i- mode : string, NONE, FULL or INCREMENTAL, default from the config
+    Run it on a new database before any table is created. On an existing
+    database the mode only takes effect after a full VACUUM.
+    """
+    if mode is None:
+        mode = get_option('auto_vacuum', 'INCREMENTAL')
+    cursor.execute("PRAGMA auto_vacuum = {}".format(mode.upper()))
+
+
+def free_space(cursor):
+    """
+    -i- cursor : sqlite cursor
+    -o- report : dict, with page_size, page_count, freelist_count,
+        file_bytes, free_bytes, free_ratio and auto_vacuum
+    """
+    values = {}
+    for name in ('page_size', 'page_count', 'freelist_count'):
+        cursor.execute("PRAGMA {}".format(name))
+        values[name] = cursor.fetchone()[0]
+    values['file_bytes'] = values['page_count'] * values['page_size']
+    values['free_bytes'] = values['freelist_count'] * values['page_size']
+    if values['page_count'] > 0:
+        values['free_ratio'] = values['freelist_count'] / values['page_count']
+    else:
+        values['free_ratio'] = 0.0
+    values['auto_vacuum'] = auto_vacuum_mode(cursor)
+    return values
+
+
+def format_bytes(nbytes):
+    size = float(nbytes)
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} TB'.format(size)
+
+
+def free_space_text(cursor):
+    """ One-line report, e.g. for the status bar """
+    r = free_space(cursor)
+    return 'Database {}, free {} ({:.1%}), auto_vacuum {}'.format(
+        format_bytes(r['file_bytes']), format_bytes(r['free_bytes']),
+        r['free_ratio'], r['auto_vacuum'])
+
+
+def incremental_vacuum(cursor, pages=None, step=None, callback=None):
+    """
+    -i- cursor : sqlite cursor, not inside a transaction
+    -i- pages : int, number of free pages to reclaim, default all
+    -i- step : int, pages per PRAGMA incremental_vacuum
+    -i- callback : function, callback(done, total) after each step,
+        e.g. to move a progress bar.
+    -o- done : int, number of pages reclaimed
+    """
+    if auto_vacuum_mode(cursor) != 'INCREMENTAL':
+        logger.warning('Database is not in incremental auto_vacuum mode')
+        return 0
+    if step is None:
+        step = get_option('vacuum_step_pages', 4096)
+    total = free_space(cursor)['freelist_count']
+    if pages is not None:
+        total = min(total, pages)
+    done = 0
+    while done < total:
+        n = min(step, total - done)
+        # The pragma frees one page per step of the statement, and
+        # execute() steps only once, so run it as a script.
+        cursor.executescript("PRAGMA incremental_vacuum({});".format(n))
+        left = free_space(cursor)['freelist_count']
+        done = total - min(total, left) if pages is None else done + n
+        if callback is not None:
+            callback(done, total)
+        if left == 0:
+            break
+    return done
+
+
+def full_vacuum(cursor, callback=None):
+    """
+    -i- callback : function, callback(done, total), called at start and
+        end because sqlite reports no progress during VACUUM.
+    Also converts an old database to the configured auto_vacuum mode.
+    """
+    if callback is not None:
+        callback(0, 1)
+    set_auto_vacuum(cursor)
+    cursor.execute("VACUUM")
+    if callback is not None:
+        callback(1, 1)
+
+
+def vacuum_policy(cursor, threshold=None, full=False, callback=None):
+    """
+    -i- cursor : sqlite cursor, not inside a transaction
+    -i- threshold : float, free ratio above which pages are reclaimed,
+        default from the config
+    -i- full : bool, run a full VACUUM, only on explicit request
+    -i- callback : function, callback(done, total) progress
+    -o- action : string, 'full', 'incremental' or 'none'
+    This replaces the VACUUM at the end of every save.
+    """
+    if full:
+        full_vacuum(cursor, callback)
+        logger.info(free_space_text(cursor))
+        return 'full'
+    if threshold is None:
+        threshold = get_option('vacuum_free_ratio', 0.25)
+    report = free_space(cursor)
+    if report['free_ratio'] <= threshold or \
+            report['auto_vacuum'] != 'INCREMENTAL':
+        return 'none'
+    incremental_vacuum(cursor, callback=callback)
+    logger.info(free_space_text(cursor))
+    return 'incremental'
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+WAL journaling and a single serialized writer for the project database.
+
+With the default rollback journal a writer locks out every reader, which
+is why saving used to raise "sqlite3.OperationalError: database is
+locked" whenever another thread touched the project. In WAL mode readers
+keep reading the last committed state while one writer appends. All
+mutations go through one DBWriter thread, which owns the only writing
+connection and batches the queued statements into transactions; readers
+open their own connections with connect_reader().
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from ezcad.utils.logger import logger
+from ezcad.utils.project_loader import connect_readonly
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',  # safe with WAL, fsync at checkpoint
+    'cache_size': -262144,  # negative is KiB, i.e. 256 MB
+    'mmap_size': 1 << 30,
+    'temp_store': 'MEMORY',
+}
+
+_STOP = object()
+
+
+def apply_pragmas(connect, **pragmas):
+    """
+    -i- connect : sqlite connection
+    -i- pragmas : overrides of PRAGMAS, a value of None skips the pragma.
+    """
+    options = dict(PRAGMAS)
+    options.update(pragmas)
+    for name, value in options.items():
+        if value is None:
+            continue
+        connect.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def connect_reader(file):
+    """
+    -i- file : string, database file
+    -o- connect : read-only sqlite connection tuned for reading
+    The journal mode is a property of the file, set by the writer.
+    """
+    connect = connect_readonly(file)
+    apply_pragmas(connect, journal_mode=None, synchronous=None)
+    return connect
+
+
+class DBWriter(threading.Thread):
+    """The only thread writing to the project database"""
+    def __init__(self, file, batch_size=1000, **pragmas):
+        """
+        -i- file : string, database file
+        -i- batch_size : int, maximum queued items per transaction
+        -i- pragmas : overrides of PRAGMAS
+        """
+        super(DBWriter, self).__init__(name='DBWriter', daemon=True)
+        self.file = file
+        self.batch_size = batch_size
+        self.pragmas = pragmas
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self.connect = None
+        self.start()
+        self._ready.wait()
+
+    def run(self):
+        try:
+            # Autocommit mode, transactions are opened explicitly per batch.
+            connect = sqlite3.connect(self.file, isolation_level=None,
+                                      detect_types=sqlite3.PARSE_DECLTYPES)
+            apply_pragmas(connect, **self.pragmas)
+            cursor = connect.cursor()
+            self.connect = connect
+        finally:
+            self._ready.set()
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stop = True
+                batch = [item for item in batch if item is not _STOP]
+            count = len(batch) + (1 if stop else 0)
+            try:
+                # Cancelled futures are skipped, the others can not be
+                # any more.
+                batch = [item for item in batch
+                         if item[1].set_running_or_notify_cancel()]
+                self._write(cursor, batch)
+            except Exception as e:
+                # Nothing may stop the thread, or flush() never returns.
+                logger.error('Database writer failed: {}'.format(e))
+                for func, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for i in range(count):
+                    self._queue.task_done()
+        connect.close()
+
+    def _rollback(self, cursor):
+        """ SQLite has already rolled back after e.g. SQLITE_FULL """
+        if self.connect.in_transaction:
+            cursor.execute('ROLLBACK')
+
+    def _write(self, cursor, batch):
+        if len(batch) == 0:
+            return
+        results = []
+        try:
+            cursor.execute('BEGIN')
+            for func, future in batch:
+                results.append(func(cursor))
+            cursor.execute('COMMIT')
+        except Exception as e:
+            self._rollback(cursor)
+            if len(batch) == 1:
+                logger.error('Rolled back write: {}'.format(e))
+                batch[0][1].set_exception(e)
+            else:
+                # Retry one by one, so only the bad write fails. The items
+                # must be repeatable, see executemany().
+                for item in batch:
+                    try:
+                        self._write(cursor, [item])
+                    except Exception as e:
+                        if not item[1].done():
+                            item[1].set_exception(e)
+            return
+        for (func, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def submit(self, func):
+        """
+        -i- func : function, func(cursor), run inside the transaction
+        -o- future : Future, of the return value of func
+        """
+        if not self.is_alive():
+            raise RuntimeError("Database writer is closed")
+        future = Future()
+        self._queue.put((func, future))
+        return future
+
+    def execute(self, sql, params=()):
+        return self.submit(lambda cursor: cursor.execute(sql, params)
+                           .rowcount)
+
+    def executemany(self, sql, rows):
+        """
+        -i- rows : iterable of parameter tuples, a generator is read into
+            a list here because a failed batch is written again
+        """
+        rows = list(rows)
+        return self.submit(lambda cursor: cursor.executemany(sql, rows)
+                           .rowcount)
+
+    def flush(self, timeout=None):
+        """
+        Block until all queued writes are committed
+        -i- timeout : float, seconds, default no limit
+        Raise RuntimeError if the writer thread has stopped, TimeoutError
+        if the writes are not done in time.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        done = self._queue.all_tasks_done
+        with done:
+            while self._queue.unfinished_tasks:
+                if not self.is_alive():
+                    raise RuntimeError("Database writer is closed")
+                wait = 0.1
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                    if wait <= 0:
+                        raise TimeoutError("Database writes not done")
+                done.wait(wait)
+
+    def close(self):
+        """ Commit the queued writes and stop the thread """
+        if self.is_alive():
+            self._queue.put(_STOP)
+            self.join()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Track which data objects and properties changed since the last save.
+
+The state is kept on the data object as dob.dirty, a dictionary like
+    {'object': True,
+     'properties': {'vint': 'modified', 'vrms': 'removed'}}
+An object without the attribute has never been saved or loaded, so it is
+considered dirty and saved in full, the same as before tracking existed.
+An object whose only changes are properties is saved incrementally
+through its save_property_to_sqlite(prop_name) and
+remove_property_from_sqlite(prop_name), if it has them.
+"""
+
+import sqlite3
+from ezcad.utils.envars import SURVEY_BOX_LINE, SURVEY_BOX_LABEL
+from ezcad.utils.array_sidecar import PendingSidecars
+from ezcad.utils.logger import logger
+
+ADDED = 'added'
+MODIFIED = 'modified'
+REMOVED = 'removed'
+
+# Reserved objects are made from the survey and never saved.
+RESERVED_OBJECTS = (SURVEY_BOX_LINE, SURVEY_BOX_LABEL)
+
+
+def _state(dob):
+    state = getattr(dob, 'dirty', None)
+    if state is None:
+        state = {'object': True, 'properties': {}}
+        dob.dirty = state
+    return state
+
+
+def mark_dirty(dob, prop_name=None, action=MODIFIED):
+    """
+    -i- dob : class, data object
+    -i- prop_name : string, name of the changed property, None if the
+        change is at the object level, e.g. style or geometry.
+    -i- action : string, one of ADDED, MODIFIED, REMOVED
+    """
+    state = _state(dob)
+    if prop_name is None:
+        state['object'] = True
+        return
+    props = state['properties']
+    previous = props.get(prop_name)
+    if action == REMOVED and previous == ADDED:
+        # added and removed before any save, nothing to write
+        props.pop(prop_name)
+    elif previous == ADDED:
+        pass  # still a new property for the next save
+    elif action == ADDED and previous in (REMOVED, MODIFIED):
+        # the saved row exists and must be replaced
+        props[prop_name] = MODIFIED
+    else:
+        props[prop_name] = action
+
+
+def mark_renamed(dob, prop_name, new_name):
+    mark_dirty(dob, prop_name, action=REMOVED)
+    mark_dirty(dob, new_name, action=ADDED)
+
+
+def mark_clean(dob):
+    """ Call after the object is saved to or loaded from the project """
+    dob.dirty = {'object': False, 'properties': {}}
+
+
+def is_dirty(dob):
+    state = getattr(dob, 'dirty', None)
+    if state is None:
+        return True
+    return state['object'] or len(state['properties']) > 0
+
+
+def dirty_properties(dob, action=None):
+    """
+    -i- dob : class, data object
+    -i- action : string, filter by action; None returns all.
+    -o- props : dict, property name to action
+    """
+    state = getattr(dob, 'dirty', None)
+    if state is None:
+        return {}
+    props = state['properties']
+    if action is None:
+        return dict(props)
+    return {k: v for k, v in props.items() if v == action}
+
+
+def dirty_objects(database):
+    """
+    -i- database : dict, object name to data object
+    -o- names : list, sorted names of objects that need saving
+    """
+    names = []
+    for object_name in sorted(database):
+        if object_name in RESERVED_OBJECTS:
+            continue
+        if is_dirty(database[object_name]):
+            names.append(object_name)
+    return names
+
+
+def count_dirty_work(database):
+    """
+    -o- count : int, number of progress steps for saving the project,
+        the dirty objects plus the clean DB and save viewer steps.
+    """
+    return len(dirty_objects(database)) + 2
+
+
+def saves_incrementally(dob):
+    """ Return True if only the flagged properties of dob are written """
+    state = getattr(dob, 'dirty', None)
+    return state is not None and not state['object'] and \
+        hasattr(dob, 'save_property_to_sqlite') and \
+        hasattr(dob, 'remove_property_from_sqlite')
+
+
+def save_dirty_object(dob):
+    """
+    Write the changes of dob with its open connection, without commit.
+    -o- saved : list, names of the properties whose arrays were written
+    """
+    if not saves_incrementally(dob):
+        dob.save_to_sqlite()
+        return list(getattr(dob, 'prop', {}))
+    saved = []
+    for prop_name, action in sorted(dirty_properties(dob).items()):
+        dob.remove_property_from_sqlite(prop_name)
+        if action != REMOVED:
+            dob.save_property_to_sqlite(prop_name)
+            saved.append(prop_name)
+    return saved
+
+
+def _mark_stored(dob, prop_names):
+    """ Lazy arrays just written may be released again """
+    props = getattr(dob, 'prop', {})
+    for prop_name in prop_names:
+        handle = getattr(props.get(prop_name), 'handle', None)
+        if handle is not None:
+            handle.mark_stored()
+
+
+def save_dirty_objects(database, filename, callback=None):
+    """
+    -i- database : dict, object name to data object
+    -i- filename : string, project database file
+    -i- callback : function, called after each object is written
+    Save only the changed objects, and of those which only have property
+    changes only the flagged properties, in one transaction. The flags
+    are cleared after the commit; on error nothing is written and the
+    flags are kept.
+    """
+    names = dirty_objects(database)
+    logger.info('Saving {} changed objects of {}'.format(
+        len(names), len(database)))
+    if len(names) == 0:
+        return
+    connect = sqlite3.connect(filename,
+                              detect_types=sqlite3.PARSE_DECLTYPES)
+    cursor = connect.cursor()
+    pending = PendingSidecars()
+    saved = {}
+    try:
+        for object_name in names:
+            dob = database[object_name]
+            dob.set_database(file=filename)
+            # All objects write through the one connection.
+            dob.connect = connect
+            dob.cursor = cursor
+            # Sidecar files are put in place after the commit.
+            dob.sidecar_ops = pending
+            saved[object_name] = save_dirty_object(dob)
+            if callback is not None:
+                callback()
+        connect.commit()
+        pending.commit()
+    except Exception:
+        connect.rollback()
+        pending.rollback()
+        logger.error('Rolled back saving the project')
+        raise
+    finally:
+        for object_name in names:
+            dob = database[object_name]
+            dob.connect = None
+            dob.cursor = None
+            dob.sidecar_ops = None
+        connect.close()
+    for object_name in names:
+        dob = database[object_name]
+        _mark_stored(dob, saved[object_name])
+        mark_clean(dob)
+
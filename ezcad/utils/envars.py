@@ -17,6 +17,8 @@ SQLITE_LIMIT_LENGTH = 1000000000  # 1 billion bytes
 
 # 2018/8/18 I tried 90 million vertexes and too slow.
 # PLOT2D_LIMIT = 10000000  # pyqtgraph.PlotWidget
+# Vertexes per object drawn while the camera moves, see utils/lod.py
+LOD_VERTEX_BUDGET = 2000000
 
 # Primary and secondary disks for JavaSeis dataset
 JAVASEIS_DATA_HOME = os.getenv('JAVASEIS_DATA_HOME')
@@ -191,29 +191,47 @@ def myprint(*args, **kwargs):
 #     myprint(*args, **kwargs)
 
 
+def gradient_key(gradient):
+    """ Hashable form of a gradient state, the dict of saveState() """
+    if gradient is None:
+        return None
+    ticks = tuple((float(x), tuple(color))
+                  for x, color in gradient.get('ticks', []))
+    return ticks, gradient.get('mode')
+
+
 def split_array(array, byteLimit):
-    size = array.shape[0]
+    splitArray = list(iter_split_array(array, byteLimit))
+    if array.nbytes >= byteLimit:
+        logger.info('input array size = {}'.format(array.shape[0]))
+        logger.info('input array bytes = {}'.format(array.nbytes))
+        logger.info('output arrays size = {}'.format(
+            [a.shape[0] for a in splitArray]))
+        logger.info('output arrays bytes = {}'.format(
+            [a.nbytes for a in splitArray]))
+    return splitArray
+
+
+def iter_split_array(array, byteLimit):
+    """
+    Generator version of split_array, yields the same splits one at a time
+    so the caller never holds all of them. A 0-d array is one split.
+    """
     byte = array.nbytes
-    if byte >= byteLimit:
-        if byte % byteLimit == 0:
-            nsplit = int(byte / byteLimit)
-        else:
-            nsplit = int(byte / byteLimit) + 1
-        nvCellSize = int(size / nsplit)
-        splitIndex = np.arange(nvCellSize, size, nvCellSize).tolist()
-        splitArray = np.split(array, splitIndex)
+    if array.ndim == 0 or byte < byteLimit:
+        yield array
+        return
+    size = array.shape[0]
+    if byte % byteLimit == 0:
+        nsplit = int(byte / byteLimit)
     else:
-        splitArray = [array]
-    cellSize = [a.shape[0] for a in splitArray]
-    cellByte = [a.nbytes for a in splitArray]
-    assert sum(cellSize) == size, "Lost element in split"
-    assert sum(cellByte) == byte, "Lost byte in split"
-    if byte >= byteLimit:
-        logger.info('input array size = {}'.format(size))
-        logger.info('input array bytes = {}'.format(byte))
-        logger.info('output arrays size = {}'.format(cellSize))
-        logger.info('output arrays bytes = {}'.format(cellByte))
-    return splitArray
+        nsplit = int(byte / byteLimit) + 1
+    nvCellSize = int(size / nsplit)
+    splitIndex = np.arange(nvCellSize, size, nvCellSize).tolist()
+    start = 0
+    for stop in splitIndex + [size]:
+        yield array[start:stop]
+        start = stop
 
 
 def split_array_test():
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Encoding of pick ids in RGBA colors for ID-buffer picking.
+
+Every pickable element (vertex, triangle) of every displayed object gets
+one 32-bit id: the object is given a contiguous range of ids and the
+element id is the start of the range plus the element index. The id is
+written as the RGBA color of the element in an offscreen pass, with
+blending and antialiasing off, and a pixel read back decodes to the
+object and element in one lookup. Id 0 is the background.
+"""
+
+import numpy as np
+
+BACKGROUND = 0
+MAX_ID = (1 << 32) - 1
+
+
+def encode_ids(ids):
+    """
+    -i- ids : int array, pick ids
+    -o- rgba : float32 array, n by 4, in [0, 1] as taken by vispy colors
+    """
+    ids = np.asarray(ids, dtype=np.uint32)
+    rgba = np.empty((len(ids), 4), dtype=np.float32)
+    for k in range(4):
+        rgba[:, k] = (ids >> (8 * k)) & 255
+    rgba /= 255
+    return rgba
+
+
+def decode_rgba(rgba):
+    """
+    -i- rgba : uint8 array, (..., 4), e.g. the image of canvas.render()
+    -o- ids : uint32 array, (...)
+    """
+    rgba = np.asarray(rgba, dtype=np.uint32)
+    return (rgba[..., 0] | (rgba[..., 1] << 8) | (rgba[..., 2] << 16) |
+            (rgba[..., 3] << 24))
+
+
+class IdRegistry:
+    """Ranges of pick ids given to the displayed objects"""
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._owners = []
+        self._starts = []
+        self._counts = []
+        self._next = 1
+
+    def register(self, owner, count):
+        """
+        -i- owner : object, e.g. the visual or its data object
+        -i- count : int, number of elements
+        -o- ids : uint32 array, the ids of the elements
+        """
+        if self._next + count - 1 > MAX_ID:
+            raise ValueError("Too many elements for 32-bit pick ids")
+        start = self._next
+        self._owners.append(owner)
+        self._starts.append(start)
+        self._counts.append(count)
+        self._next += count
+        return np.arange(start, start + count, dtype=np.uint32)
+
+    def unregister(self, owner):
+        """ Drop the range of owner; its ids are not given out again """
+        for k in reversed(range(len(self._owners))):
+            if self._owners[k] is owner:
+                del self._owners[k], self._starts[k], self._counts[k]
+
+    @property
+    def free(self):
+        """ Number of ids which can still be registered """
+        return MAX_ID - self._next + 1
+
+    def decode(self, pick_id):
+        """
+        -i- pick_id : int, decoded from a pixel
+        -o- owner : object, None for background or an unknown id
+        -o- element : int, element index in the owner, None if no owner
+        """
+        pick_id = int(pick_id)
+        if pick_id == BACKGROUND or len(self._starts) == 0:
+            return None, None
+        k = int(np.searchsorted(self._starts, pick_id, side='right')) - 1
+        if k < 0 or pick_id >= self._starts[k] + self._counts[k]:
+            return None, None
+        return self._owners[k], pick_id - self._starts[k]
+
+
+def nearest_id(ids, center, radius=None):
+    """
+    -i- ids : uint32 array, 2D window of the id buffer
+    -i- center : tuple, (row, col) of the cursor in the window
+    -i- radius : float, maximum distance in pixels, default any
+    -o- pick_id : int, the non-background id nearest to the center
+    """
+    rows, cols = np.nonzero(ids != BACKGROUND)
+    if len(rows) == 0:
+        return BACKGROUND
+    dist = (rows - center[0]) ** 2 + (cols - center[1]) ** 2
+    k = np.argmin(dist)
+    if radius is not None and dist[k] > radius * radius:
+        return BACKGROUND
+    return int(ids[rows[k], cols[k]])
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Lazy property arrays for opening a project without reading the data.
+
+When a project is opened only the metadata of each property (name, clip,
+gradient, ...) is read. The array is replaced by a LazyArray which holds
+the table and row key, and is fetched from the project database on first
+access. A property dictionary in dob.prop[...] is a LazyProperty, which
+behaves like the usual dict, e.g. prop['array1d'] returns the array.
+
+Loaded arrays are registered in a least-recently-used list, so
+release_lazy_arrays() can drop them again when memory runs short; they
+are simply re-read on the next access. Arrays set in memory, e.g. by a
+property operation, are kept until they are saved. The list holds weak
+references, so the arrays of deleted objects are not kept alive.
+"""
+
+import copy
+import threading
+import weakref
+from collections import OrderedDict
+from ezcad.utils.dbsqlite import DBSQLite
+from ezcad.utils.sqlite_chunks import cat_array
+from ezcad.utils.dirty_state import dirty_properties
+from ezcad.utils.logger import logger
+
+_LOADED = OrderedDict()  # id(handle) -> weakref of handle, oldest first
+_LOADED_LOCK = threading.Lock()
+
+
+class LazyArray:
+    """Handle of an array stored in chunks in the project database"""
+    def __init__(self, file, table, key, column='arr', owner=None,
+                 prop_name=None):
+        """
+        -i- file : string, project database file
+        -i- table : string, table name
+        -i- key : dict, column name to value of the row key,
+            e.g. {'object_name': 'cube1', 'prop_name': 'vint'}
+        -i- column : string, column of the array chunks
+        -i- owner : class, data object holding the property
+        -i- prop_name : string, property name in the owner
+        The owner and prop_name are used to keep a modified array in
+        memory until it is saved.
+        """
+        self.file = file
+        self.table = table
+        self.key = dict(key)
+        self.column = column
+        self._owner = None if owner is None else weakref.ref(owner)
+        self.prop_name = prop_name
+        self._array = None
+        self._lock = threading.Lock()
+        self.stored = True
+
+    def __repr__(self):
+        return "LazyArray({}, {})".format(self.table, self.key)
+
+    def __deepcopy__(self, memo):
+        owner = None if self._owner is None else self._owner()
+        if owner is not None:
+            owner = memo.get(id(owner))
+        new = LazyArray(self.file, self.table, self.key, self.column,
+                        owner=owner, prop_name=self.prop_name)
+        memo[id(self)] = new
+        # The copy owns a snapshot, it must not read the row of the
+        # source, which may change or be removed; it is kept in memory
+        # until saved under its own key.
+        new.set(copy.deepcopy(self.load(), memo))
+        return new
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_owner'] = None  # a weak reference cannot be pickled
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._array is not None
+
+    @property
+    def nbytes(self):
+        if self._array is None:
+            return 0
+        return self._array.nbytes
+
+    @property
+    def modified(self):
+        """ True if the array has changes not saved to database """
+        owner = None if self._owner is None else self._owner()
+        if owner is None:
+            return False
+        return self.prop_name in dirty_properties(owner)
+
+    def fetch(self):
+        """ Read the array from database, bypassing the cache """
+        logger.info('Fetching {}'.format(self))
+        db_sqlite = DBSQLite(file=self.file)
+        try:
+            return cat_array(db_sqlite.cursor, self.table, self.key,
+                             self.column)
+        finally:
+            db_sqlite.connect.close()
+
+    def load(self):
+        """ Return the array, fetch it at the first call """
+        with self._lock:
+            if self._array is None:
+                self._array = self.fetch()
+            array = self._array
+        _touch(self)
+        return array
+
+    def release(self):
+        """
+        Drop the array from memory; it is re-read at next load.
+        -o- released : bool, False if kept because it is modified or not
+            stored in the database.
+        """
+        if not self.stored or self.modified:
+            return False
+        with self._lock:
+            self._array = None
+        with _LOADED_LOCK:
+            ref = _LOADED.get(id(self))
+            if ref is not None and ref() is self:
+                del _LOADED[id(self)]
+        return True
+
+    def set(self, array):
+        """ Replace the array, e.g. after a property operation """
+        with self._lock:
+            self._array = array
+            self.stored = False
+        _touch(self)
+
+    def mark_stored(self):
+        """ Call after the array is saved to the row of the handle """
+        self.stored = True
+
+
+def _touch(handle):
+    with _LOADED_LOCK:
+        _LOADED.pop(id(handle), None)
+        _LOADED[id(handle)] = weakref.ref(handle)
+
+
+def _loaded_handles():
+    """ Live handles, oldest first; entries of deleted ones are dropped """
+    with _LOADED_LOCK:
+        handles = []
+        for key, ref in list(_LOADED.items()):
+            handle = ref()
+            if handle is None:
+                del _LOADED[key]
+            else:
+                handles.append(handle)
+        return handles
+
+
+class LazyProperty(dict):
+    """Property dictionary whose array is a LazyArray"""
+    def __init__(self, handle, array_key='array1d', **items):
+        """
+        -i- handle : LazyArray
+        -i- array_key : string, key of the array, e.g. array1d, array3d
+        -i- items : the other property items, e.g. colorClip, colorGradient
+        """
+        dict.__init__(self, **items)
+        self.handle = handle
+        self.array_key = array_key
+
+    def __getitem__(self, key):
+        if key == self.array_key:
+            return self.handle.load()
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        if key == self.array_key:
+            self.handle.set(value)
+        else:
+            dict.__setitem__(self, key, value)
+
+    def __contains__(self, key):
+        return key == self.array_key or dict.__contains__(self, key)
+
+    def __iter__(self):
+        yield from dict.__iter__(self)
+        if not dict.__contains__(self, self.array_key):
+            yield self.array_key
+
+    def __len__(self):
+        return dict.__len__(self) + \
+            (not dict.__contains__(self, self.array_key))
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        """ The values, the array included, which loads it """
+        return [self[key] for key in self]
+
+    def items(self):
+        """ The items, the array included, which loads it """
+        return [(key, self[key]) for key in self]
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def copy(self):
+        """ Shallow copy, sharing the LazyArray """
+        return LazyProperty(self.handle, self.array_key,
+                            **dict(dict.items(self)))
+
+    def __copy__(self):
+        return self.copy()
+
+    def __reduce__(self):
+        # The array is not an item, it is pickled with the handle.
+        return (LazyProperty, (self.handle, self.array_key), None, None,
+                iter(dict.items(self)))
+
+    def __deepcopy__(self, memo):
+        new = LazyProperty(copy.deepcopy(self.handle, memo), self.array_key)
+        memo[id(self)] = new
+        for key, value in dict.items(self):
+            dict.__setitem__(new, key, copy.deepcopy(value, memo))
+        return new
+
+    @property
+    def loaded(self):
+        return self.handle.loaded
+
+    def release(self):
+        return self.handle.release()
+
+
+def loaded_bytes():
+    return sum(h.nbytes for h in _loaded_handles())
+
+
+def release_lazy_arrays(budget=0):
+    """
+    -i- budget : int, bytes of lazy arrays allowed to stay in memory
+    -o- released : int, bytes released
+    Release the least recently used arrays until under the budget.
+    Modified arrays are kept until they are saved.
+    """
+    released = 0
+    handles = _loaded_handles()
+    total = sum(h.nbytes for h in handles)
+    for handle in handles:
+        if total <= budget:
+            break
+        nbytes = handle.nbytes
+        if handle.release():
+            total -= nbytes
+            released += nbytes
+    if released > 0:
+        logger.info('Released {} bytes of lazy arrays'.format(released))
+    return released
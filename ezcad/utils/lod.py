@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Level-of-detail decimation of Point and Line vertexes.
+
+A LodSet holds decimation levels of one object as vertex index arrays,
+level 0 being all vertexes. Points are thinned by voxel-grid subsampling,
+one vertex per voxel, the voxel size doubling from level to level; each
+level is computed from the previous one, so only level 1 touches all
+vertexes. Lines keep the first, last, min and max vertex along an axis
+in each bucket of consecutive vertexes, so peaks survive decimation.
+Each run of connected vertexes is decimated on its own and the level
+has its own connection, so separate pieces are never joined; lines of
+independent segments are not decimated.
+
+While the camera moves, a viewer draws the level selected from the
+camera distance and the vertex budget; LodController switches back to
+level 0 once the view has settled.
+"""
+
+import numpy as np
+from qtpy.QtCore import QTimer
+from ezcad.utils.envars import LOD_VERTEX_BUDGET
+from ezcad.utils.logger import logger
+
+MIN_LEVEL_VERTEXES = 100000
+SETTLE_MS = 300
+
+
+def voxel_subsample(xyz, size, origin=None):
+    """
+    -i- xyz : array, n by 3
+    -i- size : float, voxel edge length
+    -i- origin : array, 3, corner of the voxel grid, default the minimum
+    -o- index : int array, the first vertex of each occupied voxel, sorted
+    """
+    if origin is None:
+        origin = xyz.min(axis=0)
+    q = np.floor((xyz - origin) / size).astype(np.int64)
+    dims = q.max(axis=0) + 1
+    key = (q[:, 0] * dims[1] + q[:, 1]) * dims[2] + q[:, 2]
+    unique, index = np.unique(key, return_index=True)
+    return np.sort(index)
+
+
+def minmax_decimate(xyz, factor, axis=2):
+    """
+    -i- xyz : array, n by 3, vertexes of a polyline
+    -i- factor : int, number of vertexes per bucket
+    -i- axis : int, component whose extremes are kept, default z
+    -o- index : int array, sorted, at most 2 per bucket plus both ends
+    """
+    n = len(xyz)
+    if n <= 2 or factor <= 2:
+        return np.arange(n)
+    values = xyz[:, axis]
+    nb = -(-n // factor)
+    padded = np.empty(nb * factor, dtype=values.dtype)
+    padded[:n] = values
+    padded[n:] = values[-1]
+    buckets = padded.reshape(nb, factor)
+    offset = np.arange(nb) * factor
+    imin = np.minimum(offset + np.argmin(buckets, axis=1), n - 1)
+    imax = np.minimum(offset + np.argmax(buckets, axis=1), n - 1)
+    return np.unique(np.concatenate(([0, n - 1], imin, imax)))
+
+
+def line_runs(n, connect='strip'):
+    """
+    -i- n : int, number of vertexes
+    -i- connect : 'strip', 'segments' or int array, m by 2, as vispy Line
+    -o- runs : int array, k by 2, start and stop of each run of
+        consecutively connected vertexes; None if the line is not made
+        of runs, e.g. 'segments', which has nothing to decimate
+    """
+    if connect is None or connect is True or \
+            (isinstance(connect, str) and connect == 'strip'):
+        return np.array([[0, n]])
+    if isinstance(connect, str):
+        return None
+    seg = np.unique(np.asarray(connect).reshape(-1, 2), axis=0)
+    if len(seg) == 0 or np.any(seg[:, 1] != seg[:, 0] + 1):
+        return None
+    brk = np.nonzero(seg[1:, 0] != seg[:-1, 1])[0] + 1
+    starts = seg[np.r_[0, brk], 0]
+    stops = seg[np.r_[brk - 1, len(seg) - 1], 1] + 1
+    return np.stack((starts, stops), axis=-1)
+
+
+def decimate_runs(xyz, factor, runs, axis=2):
+    """
+    -i- xyz : array, n by 3, vertexes of the line
+    -i- factor : int, see minmax_decimate()
+    -i- runs : int array, k by 2, see line_runs()
+    -i- axis : int, see minmax_decimate()
+    -o- index : int array, kept vertexes
+    -o- connect : 'strip' for one run, else int array of the segments,
+        as indexes into xyz[index]
+    """
+    parts, segments = [], []
+    count = 0
+    for start, stop in runs:
+        sub = start + minmax_decimate(xyz[start:stop], factor, axis)
+        k = len(sub)
+        if k > 1:
+            segments.append(count + np.stack(
+                (np.arange(k - 1), np.arange(1, k)), axis=-1))
+        parts.append(sub)
+        count += k
+    index = np.concatenate(parts)
+    if len(runs) == 1:
+        return index, 'strip'
+    if len(segments) == 0:
+        return index, np.empty((0, 2), dtype=np.int64)
+    return index, np.concatenate(segments)
+
+
+class LodSet:
+    """Decimation levels of the vertexes of one object"""
+    def __init__(self, xyz, kind='point', min_vertexes=MIN_LEVEL_VERTEXES,
+                 connect='strip'):
+        """
+        -i- xyz : array, n by 3 vertexes
+        -i- kind : string, 'point' or 'line'
+        -i- min_vertexes : int, stop decimating below this count
+        -i- connect : connect of the line, see line_runs()
+        """
+        xyz = np.asarray(xyz)
+        self.kind = kind
+        self.levels = [None]  # None is all vertexes
+        self.connects = [connect]
+        self.counts = [len(xyz)]
+        self.sizes = [0.0]
+        if len(xyz) <= min_vertexes:
+            return
+        if kind == 'point':
+            self._build_points(xyz, min_vertexes)
+        elif kind == 'line':
+            runs = line_runs(len(xyz), connect)
+            if runs is None:
+                logger.info('No LOD for a line of separate segments')
+                return
+            self._build_lines(xyz, min_vertexes, runs)
+        else:
+            raise ValueError("Unknown kind {}".format(kind))
+        logger.info('LOD levels of {} vertexes: {}'.format(
+            len(xyz), self.counts))
+
+    def _build_points(self, xyz, min_vertexes):
+        origin = xyz.min(axis=0)
+        extent = float((xyz.max(axis=0) - origin).max()) or 1.0
+        # Start at about one vertex per voxel of the bounding cube.
+        size = extent / np.cbrt(len(xyz))
+        index = np.arange(len(xyz))
+        while self.counts[-1] > min_vertexes:
+            sub = voxel_subsample(xyz[index], size, origin)
+            if len(sub) < 0.75 * len(index):
+                index = index[sub]
+                self.levels.append(index)
+                self.connects.append(None)
+                self.counts.append(len(index))
+                self.sizes.append(size)
+            if size > extent:
+                break
+            size *= 2
+
+    def _build_lines(self, xyz, min_vertexes, runs):
+        factor = 4
+        while self.counts[-1] > min_vertexes and factor < len(xyz):
+            index, connect = decimate_runs(xyz, factor, runs)
+            if len(index) >= self.counts[-1]:
+                break  # runs too short to decimate further
+            self.levels.append(index)
+            self.connects.append(connect)
+            self.counts.append(len(index))
+            self.sizes.append(float(factor))
+            factor *= 4
+
+    def indices(self, level):
+        """ Vertex index of a level, None for all vertexes """
+        return self.levels[level]
+
+    def connection(self, level):
+        """ Line connect of the vertexes of a level, None for points """
+        return self.connects[level]
+
+    def select(self, distance, viewport_height, fov=0.0,
+               budget=LOD_VERTEX_BUDGET):
+        """
+        -i- distance : float, camera distance, or scale factor of an
+            orthographic camera
+        -i- viewport_height : int, pixels
+        -i- fov : float, field of view in degrees, 0 for orthographic
+        -i- budget : int, maximum vertexes drawn while moving
+        -o- level : int, the finest level within the budget, or coarser
+            if its voxels are still smaller than a pixel
+        """
+        level = 0
+        while level < len(self.counts) - 1 and self.counts[level] > budget:
+            level += 1
+        if self.kind == 'point':
+            if fov > 0:
+                pixel = 2 * distance * np.tan(np.radians(fov) / 2)
+            else:
+                pixel = distance
+            pixel /= max(1, viewport_height)
+            while level < len(self.sizes) - 1 and \
+                    self.sizes[level + 1] <= pixel:
+                level += 1
+        return level
+
+
+class LodController:
+    """Draw decimated levels while the camera moves, full detail after"""
+    def __init__(self, apply_level, settle_ms=SETTLE_MS):
+        """
+        -i- apply_level : function, apply_level(name, lodset, level),
+            sets the vertexes of the visual, e.g. set_data with
+            xyz[lodset.indices(level)] and, for a line,
+            connect=lodset.connection(level)
+        -i- settle_ms : int, idle time before full detail is restored
+        """
+        self.apply_level = apply_level
+        self.lodsets = {}
+        self.current = {}
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(settle_ms)
+        self.timer.timeout.connect(self.settle)
+
+    def add(self, name, lodset):
+        self.lodsets[name] = lodset
+        self.current[name] = 0
+
+    def remove(self, name):
+        self.lodsets.pop(name, None)
+        self.current.pop(name, None)
+
+    def _set(self, name, level):
+        if self.current.get(name) != level:
+            self.current[name] = level
+            self.apply_level(name, self.lodsets[name], level)
+
+    def camera_changed(self, distance, viewport_height, fov=0.0):
+        """ Connect to the camera change of the viewer """
+        for name, lodset in self.lodsets.items():
+            self._set(name, lodset.select(distance, viewport_height, fov))
+        self.timer.start()
+
+    def settle(self):
+        for name in self.lodsets:
+            self._set(name, 0)
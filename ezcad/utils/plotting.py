@@ -2,10 +2,24 @@
 # Copyright (c) Ezcad Development Team. All Rights Reserved.
 """
 Plot and visualize data
+
+Colormaps and LUTs made from a gradient are cached by the gradient key
+(ticks with their alpha, and mode) and shared by all visuals, so they are
+read-only; a caller which changes its colormap asks for a copy.
+Visuals which color scalar data in the shader, e.g. vispy Image, only get
+a new clim when the clip changes; see update_visual_colormap().
 """
 
+from collections import OrderedDict
+import copy
+import threading
+import numpy as np
 import pyqtgraph as pg
 import vispy as vp
+from ezcad.utils.functions import gradient_key
+
+COLORMAP_CACHE_SIZE = 64
+LUT_SIZE = 512
 
 
 # from vispy.visuals.markers import _marker_dict # TODO
@@ -63,13 +77,48 @@ def set_gradient_alpha(gradient, alpha):
     # What is the pros/cons of using tuple or list?
 
 
-def make_colormap_from_gradient(clip, gradient):
+_colormaps = OrderedDict()
+_colormaps_lock = threading.Lock()
+
+
+def _cached(key, make):
+    """ Object of key from the colormap cache, made on a miss. Worker
+    threads get here through get_lut, so the dict is locked; make() runs
+    outside the lock and the first value stored wins. """
+    with _colormaps_lock:
+        value = _colormaps.get(key)
+        if value is not None:
+            _colormaps.move_to_end(key)
+            return value
+    value = make()
+    with _colormaps_lock:
+        value = _colormaps.setdefault(key, value)
+        _colormaps.move_to_end(key)
+        if len(_colormaps) > COLORMAP_CACHE_SIZE:
+            _colormaps.popitem(last=False)
+    return value
+
+
+def clear_colormap_cache():
+    with _colormaps_lock:
+        _colormaps.clear()
+
+
+def make_colormap_from_gradient(clip, gradient, copied=False):
     """
     -i- clip : list, clip value, [min, max], physical values
     -i- gradient : dictionary, color gradient, grade value range is 0-1.
-    -o- colormap : class object
+    -i- copied : bool, return a copy which the caller may modify
+    -o- colormap : pyqtgraph ColorMap, shared and read-only unless copied
     Scale the gradient to the clip range and return colormap.
     """
+    key = ('pg', tuple(float(c) for c in clip), gradient_key(gradient))
+    colormap = _cached(key, lambda: _make_colormap_from_gradient(
+        clip, gradient))
+    return copy.deepcopy(colormap) if copied else colormap
+
+
+def _make_colormap_from_gradient(clip, gradient):
     mode = gradient['mode']
     pos, color = [], []
     for tick in gradient['ticks']:
@@ -81,7 +130,19 @@ def make_colormap_from_gradient(clip, gradient):
     return colormap
 
 
-def make_colormap_from_gradient_vispy(gradient):
+def make_colormap_from_gradient_vispy(gradient, copied=False):
+    """
+    -i- gradient : dictionary, color gradient
+    -i- copied : bool, return a copy which the caller may modify
+    -o- colormap : vispy Colormap, shared and read-only unless copied
+    """
+    key = ('vispy', gradient_key(gradient))
+    colormap = _cached(key, lambda: _make_colormap_from_gradient_vispy(
+        gradient))
+    return copy.deepcopy(colormap) if copied else colormap
+
+
+def _make_colormap_from_gradient_vispy(gradient):
     ticks = sorted(gradient['ticks'], key=lambda tup: tup[0])
     controls, colors = [], []
     for tick in ticks:
@@ -93,6 +154,42 @@ def make_colormap_from_gradient_vispy(gradient):
     return colormap
 
 
+def get_lut(gradient, n=LUT_SIZE):
+    """
+    -i- gradient : dictionary, color gradient
+    -i- n : int, number of colors
+    -o- lut : uint8 array, (n, 4) RGBA, read-only and shared
+    """
+    def make():
+        colormap = make_colormap_from_gradient_vispy(gradient)
+        rgba = colormap.map(np.linspace(0, 1, n)[:, np.newaxis])
+        lut = np.rint(np.clip(rgba, 0, 1) * 255).astype(np.uint8)
+        lut.setflags(write=False)
+        return lut
+    return _cached(('lut', n, gradient_key(gradient)), make)
+
+
+def update_visual_colormap(visual, gradient, clip):
+    """
+    -i- visual : vispy visual of scalar data
+    -i- gradient : dictionary, color gradient
+    -i- clip : list, clip value, [min, max]
+    -o- done : bool, False if the visual has no colormap of its own, so
+        its colors must be computed on the CPU, e.g. with get_lut()
+    The data stays on the GPU: a clip change sets the clim uniform, and a
+    gradient change swaps the shared colormap, whose LUT texture is small.
+    """
+    if not (hasattr(visual, 'cmap') and hasattr(visual, 'clim')):
+        return False
+    colormap = make_colormap_from_gradient_vispy(gradient)
+    if visual.cmap is not colormap:
+        visual.cmap = colormap
+    clim = (float(clip[0]), float(clip[1]))
+    if tuple(visual.clim) != clim:
+        visual.clim = clim
+    return True
+
+
 # def make_colorbar(cmap):
 #     """ make the default colorbar """
 #     from ezcad.widgets.colorbar import ColorBar
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Load the objects of a project in parallel, in dependency order.
+
+Objects on the survey grid (Gsurface, Cube) need the survey before
+set_survey, so they depend on it. Instead of one thread per object
+polling for the survey, the loader builds the dependency graph and runs
+it on a bounded thread pool: the survey and independent objects start at
+once, the dependents are submitted when the survey is done.
+"""
+
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from ezcad.utils.envars import NCORE
+from ezcad.utils.logger import logger
+
+SURVEY_DEPENDENT_TYPES = ('Gsurface', 'Cube')
+
+
+def connect_readonly(file):
+    """
+    -i- file : string, database file
+    -o- connect : sqlite connection which can only read
+    """
+    # as_uri() percent-encodes e.g. '?', '#' and '%' of the path.
+    uri = pathlib.Path(file).resolve().as_uri() + '?mode=ro'
+    return sqlite3.connect(uri, uri=True,
+                           detect_types=sqlite3.PARSE_DECLTYPES,
+                           check_same_thread=False)
+
+
+def build_dependency_graph(objects):
+    """
+    -i- objects : list, of tuples (object_name, geometry_type)
+    -o- graph : dict, object name to set of names it depends on
+    """
+    survey_names = [name for name, geom in objects if geom == 'Survey']
+    if len(survey_names) > 1:
+        logger.warning('Found {} surveys, use {}'.format(
+            len(survey_names), survey_names[0]))
+    graph = {}
+    for name, geom in objects:
+        deps = set()
+        if geom in SURVEY_DEPENDENT_TYPES:
+            if len(survey_names) > 0:
+                deps.add(survey_names[0])
+            else:
+                logger.warning('{} needs a survey but none is found'
+                               .format(name))
+        graph[name] = deps
+    return graph
+
+
+class ProjectLoader:
+    """Run object loading over a dependency graph on a thread pool"""
+    def __init__(self, load_func, callback=None, max_workers=None,
+                 file=None):
+        """
+        -i- load_func : function, load_func(object_name, geometry_type)
+        -i- callback : function, callback(object_name, ok) after each
+            object, e.g. to emit sigLoadedObjectFromSqlite.
+        -i- max_workers : int, pool size, default from NCORE
+        -i- file : string, project file for the read-only connection of
+            each worker, see connection(). Needed if load_func reads the
+            project through connection().
+        """
+        if file is not None and not os.path.isfile(file):
+            raise FileNotFoundError("Project file {} is not found".format(
+                file))
+        self.load_func = load_func
+        self.callback = callback
+        if max_workers is None:
+            max_workers = max(1, (NCORE or 1))
+        self.max_workers = max_workers
+        self.file = file
+        self.timing = {}
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._pool = None
+        self._geom = {}
+        self._waiting = {}
+        self._failed = set()
+        self._remaining = 0
+        self._start = None
+        self.finished = threading.Event()
+
+    def connection(self):
+        """ Read-only sqlite connection of the calling worker thread """
+        connect = getattr(self._local, 'connect', None)
+        if connect is None:
+            if self.file is None:
+                raise ValueError("ProjectLoader has no project file")
+            connect = connect_readonly(self.file)
+            self._local.connect = connect
+            with self._lock:
+                self._connections.append(connect)
+        return connect
+
+    def start(self, objects):
+        """
+        -i- objects : list, of tuples (object_name, geometry_type)
+        Return at once; the loading runs in the pool.
+        """
+        graph = build_dependency_graph(objects)
+        self._geom = dict(objects)
+        self._waiting = {name: set(deps) for name, deps in graph.items()}
+        self._remaining = len(graph)
+        self._start = time.time()
+        self.finished.clear()
+        if self._remaining == 0:
+            self.finished.set()
+            return
+        logger.info('Loading {} objects with {} workers'.format(
+            len(graph), self.max_workers))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        with self._lock:
+            ready = [name for name, deps in self._waiting.items()
+                     if len(deps) == 0]
+            for name in ready:
+                self._waiting.pop(name)
+        for name in ready:
+            self._submit(name)
+
+    def wait(self, timeout=None):
+        return self.finished.wait(timeout)
+
+    def _submit(self, name):
+        self._pool.submit(self._run, name)
+
+    def _run(self, name):
+        t0 = time.time()
+        ok = True
+        try:
+            self.load_func(name, self._geom[name])
+        except Exception as e:
+            ok = False
+            logger.error('Failed loading {}: {}'.format(name, e))
+        seconds = time.time() - t0
+        self.timing[name] = seconds
+        logger.info('Loaded {} in {:.2f} s'.format(name, seconds))
+        self._done(name, ok)
+
+    def _done(self, name, ok):
+        ready, skipped = [], []
+        with self._lock:
+            if not ok:
+                self._failed.add(name)
+            for other, deps in list(self._waiting.items()):
+                if name in deps:
+                    deps.discard(name)
+                    if not ok:
+                        skipped.append(other)
+                        self._waiting.pop(other)
+                    elif len(deps) == 0:
+                        ready.append(other)
+                        self._waiting.pop(other)
+        try:
+            if self.callback is not None:
+                try:
+                    self.callback(name, ok)
+                except Exception as e:
+                    logger.error('Loaded callback failed for {}: {}'.format(
+                        name, e))
+            for other in skipped:
+                logger.error('Skip {} because {} failed'.format(other, name))
+                self._failed.add(other)
+                self._done(other, False)
+            for other in ready:
+                self._submit(other)
+        finally:
+            # Always count the object, or wait() never returns.
+            with self._lock:
+                self._remaining -= 1
+                last = self._remaining == 0
+            if last:
+                self._finish()
+
+    def _finish(self):
+        total = time.time() - self._start
+        logger.info('Loaded project in {:.2f} s'.format(total))
+        for name in sorted(self.timing, key=self.timing.get, reverse=True):
+            logger.info('    {:.2f} s {}'.format(self.timing[name], name))
+        if len(self._failed) > 0:
+            logger.warning('Failed: {}'.format(sorted(self._failed)))
+        for connect in self._connections:
+            connect.close()
+        self._connections = []
+        self._pool.shutdown(wait=False)
+        self.finished.set()
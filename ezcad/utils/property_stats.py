@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Histogram and percentiles of property arrays, computed once and cached.
+
+The colorbar editor and the property table both need the value
+distribution of a property. On a large cube a full histogram or
+np.percentile over every value takes seconds, so arrays larger than
+STATS_SAMPLES values are summarized from a random subsample read in
+sorted order, which is fast on a memmap too. The inner percentiles
+come from the sample; P0 and P100 are the exact minimum and maximum from
+a pass over the whole array in blocks, unless exact_range is turned off.
+The result is cached on the property as prop['arrayStats'] and
+recomputed when the array is replaced, on request, e.g. by the Refresh
+button of the property table, or after invalidate_stats(), which the
+in-place edits of a property array must call.
+"""
+
+import numpy as np
+from ezcad.utils.logger import logger
+
+STATS_KEY = 'arrayStats'
+STATS_SAMPLES = 1 << 20
+HISTOGRAM_BINS = 256
+PERCENTILES = (0, 10, 50, 90, 100)
+ARRAY_KEYS = ('array1d', 'array2d', 'array3d')
+
+
+def property_array(prop):
+    """
+    -i- prop : dict, for example cube.prop[prop]
+    -o- data : array of the property
+    """
+    for key in ARRAY_KEYS:
+        if key in prop:
+            return prop[key]
+    raise ValueError("Unknown value")
+
+
+def sample_values(data, nsample=STATS_SAMPLES, seed=0):
+    """
+    -i- data : array, any shape
+    -i- nsample : int, maximum number of values
+    -o- values : 1D array, finite values, all of them if data is small
+    -o- sampled : bool, True if values is a subsample
+    """
+    data = np.asanyarray(data)
+    sampled = data.size > nsample
+    if sampled:
+        # Index the array itself, a flat view would copy it if it is not
+        # contiguous.
+        rng = np.random.default_rng(seed)
+        index = np.sort(rng.integers(0, data.size, nsample))
+        flat = np.asarray(data[np.unravel_index(index, data.shape)])
+    else:
+        flat = np.ravel(data)
+    if flat.dtype.kind == 'f':
+        flat = flat[np.isfinite(flat)]
+    return flat, sampled
+
+
+def value_range(data, block=STATS_SAMPLES):
+    """
+    -i- data : array, any shape
+    -i- block : int, values per block
+    -o- vmin, vmax : float, exact finite minimum and maximum
+    """
+    data = np.asanyarray(data)
+    if data.ndim == 0:
+        data = data.reshape(1)
+    vmin, vmax = np.inf, -np.inf
+    # Blocks of whole rows along the first axis, views without a copy.
+    rowSize = max(1, data.size // max(1, data.shape[0]))
+    step = max(1, block // rowSize)
+    for start in range(0, data.shape[0], step):
+        values = data[start:start + step]
+        if values.dtype.kind == 'f':
+            values = values[np.isfinite(values)]
+        if values.size > 0:
+            vmin = min(vmin, float(values.min()))
+            vmax = max(vmax, float(values.max()))
+    return vmin, vmax
+
+
+def compute_stats(data, bins=HISTOGRAM_BINS, percentiles=PERCENTILES,
+                  nsample=STATS_SAMPLES, exact_range=True):
+    """
+    -i- data : array of a property
+    -i- bins : int, number of histogram bins
+    -i- percentiles : tuple, percentiles in 0-100
+    -i- nsample : int, subsample arrays with more values than this
+    -i- exact_range : bool, P0 and P100 of a subsampled array from a
+        pass over all values instead of the sample, also the range of
+        the histogram
+    -o- stats : dict, with counts and edges of the histogram,
+        percentiles and their values, size of the array and sampled
+    """
+    values, sampled = sample_values(data, nsample)
+    stats = {'size': int(np.size(data)), 'sampled': sampled,
+             'percentiles': tuple(percentiles)}
+    if values.size == 0:
+        stats['values'] = [np.nan] * len(percentiles)
+        stats['counts'] = np.zeros(bins, dtype=np.int64)
+        stats['edges'] = np.linspace(0, 1, bins + 1)
+        return stats
+    stats['values'] = [float(v) for v in np.percentile(values, percentiles)]
+    vmin, vmax = float(values.min()), float(values.max())
+    if sampled and exact_range:
+        vmin, vmax = value_range(data)
+        for i, p in enumerate(percentiles):
+            if p == 0:
+                stats['values'][i] = vmin
+            elif p == 100:
+                stats['values'][i] = vmax
+    if vmin == vmax:
+        vmin, vmax = vmin - 0.5, vmax + 0.5
+    counts, edges = np.histogram(values, bins=bins, range=(vmin, vmax))
+    stats['counts'] = counts
+    stats['edges'] = edges
+    return stats
+
+
+def _array_key(prop):
+    """ Identity of the array, None if a lazy array is not loaded """
+    if getattr(prop, 'loaded', True) is False:
+        return None
+    data = property_array(prop)
+    return (id(data), np.shape(data), np.asarray(data).dtype.str)
+
+
+def get_stats(prop, refresh=False, exact_range=True):
+    """
+    -i- prop : dict, for example cube.prop[prop]
+    -i- refresh : bool, compute again even if cached
+    -i- exact_range : bool, see compute_stats()
+    -o- stats : dict, see compute_stats()
+    """
+    stats = prop.get(STATS_KEY) if not refresh else None
+    if stats is not None:
+        key = _array_key(prop)
+        if (key is None or key == stats['key']) and \
+                (stats['exact_range'] or not exact_range):
+            return stats
+    data = property_array(prop)
+    stats = compute_stats(data, exact_range=exact_range)
+    stats['exact_range'] = exact_range or not stats['sampled']
+    stats['key'] = _array_key(prop)
+    prop[STATS_KEY] = stats
+    if stats['sampled']:
+        logger.info('Property statistics from {} of {} values'.format(
+            STATS_SAMPLES, stats['size']))
+    return stats
+
+
+def invalidate_stats(prop):
+    """ Call after the array of prop is edited in place """
+    if STATS_KEY in prop:
+        del prop[STATS_KEY]
+
+
+def histogram_curve(stats):
+    """
+    -i- stats : dict, see compute_stats()
+    -o- x, y : arrays, bin centers and counts for plotting
+    """
+    edges = stats['edges']
+    return (edges[:-1] + edges[1:]) / 2, stats['counts']
+
+
+def main():
+    import time
+    cube = np.random.randn(400, 500, 1000).astype(np.float32)
+    prop = {'array3d': cube}
+    t0 = time.time()
+    full = np.percentile(cube, PERCENTILES)
+    t1 = time.time()
+    stats = get_stats(prop, exact_range=False)
+    t2 = time.time()
+    get_stats(prop, exact_range=False)
+    t3 = time.time()
+    exact = get_stats(prop)
+    t4 = time.time()
+    print('Full percentiles {:.3f} s: {}'.format(t1 - t0, full))
+    print('Sampled stats {:.3f} s: {}'.format(t2 - t1, stats['values']))
+    print('Cached stats {:.6f} s'.format(t3 - t2))
+    print('Exact range {:.3f} s: {}'.format(t4 - t3, exact['values']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Section cache shared by all viewers.
+
+Cube sections used to be kept per viewer in dob.section_image,
+dob.section_image3d and dob.aline_image for the whole session. The
+SectionCache keeps one entry per (cube, property, section type, section
+number, colormap, clip): the color-mapped section put by its producer,
+e.g. the SectionPrefetcher, and the visual node of each viewer showing
+it. The viewers only register their nodes, with the memory of their
+image data; a node is under one key at a time, so a viewer updating its
+image in place moves it to the new section. The data itself is shared only when the section extraction
+goes through get_or_make(). Entries count against a memory budget and
+the least recently used ones are evicted; eviction callbacks let the
+owners of the nodes release them, and a closed viewer drops its nodes
+with discard_nodes().
+"""
+
+from collections import OrderedDict
+import threading
+from ezcad.utils.functions import gradient_key
+from ezcad.utils.logger import logger
+
+MEGABYTE = 1 << 20
+DEFAULT_BUDGET_MB = 1024
+
+
+def section_key(object_name, prop_name, section_type, section_number,
+                gradient=None, clip=None):
+    """
+    -i- object_name : string, cube name
+    -i- prop_name : string, property name
+    -i- section_type : string, iline, xline, depth or the aline name
+    -i- section_number : int, None for aline
+    -i- gradient : dict, color gradient of the property
+    -i- clip : tuple, (min, max) color clip of the property
+    -o- key : tuple, key of the section cache
+    """
+    if clip is not None:
+        clip = tuple(float(c) for c in clip)
+    return (object_name, prop_name, section_type, section_number,
+            gradient_key(gradient), clip)
+
+
+class SectionEntry:
+    """Data of one section and the nodes of the viewers showing it"""
+    __slots__ = ('data', 'nbytes', 'nodes', 'node_nbytes')
+
+    def __init__(self, data, nbytes):
+        self.data = data
+        self.nbytes = nbytes
+        self.nodes = {}
+        self.node_nbytes = {}
+
+    def size(self):
+        """ Bytes of the data and of the nodes """
+        return self.nbytes + sum(self.node_nbytes.values())
+
+
+class SectionCache:
+    """LRU cache of section data with a memory budget"""
+    def __init__(self, budget=DEFAULT_BUDGET_MB * MEGABYTE):
+        """
+        -i- budget : int, bytes of section data kept in memory
+        """
+        self.budget = budget
+        self._entries = OrderedDict()
+        self._callbacks = []
+        self._lock = threading.RLock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def has_data(self, key):
+        """ True if the entry of key holds data, not only nodes; not
+        counted as a lookup """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry.data is not None
+
+    def add_callback(self, callback):
+        """
+        -i- callback : function, callback(key, entry), called when an
+            entry is evicted or discarded. It runs on the thread which
+            caused the eviction, e.g. a prefetch worker calling put(), so
+            callbacks touching Qt or vispy objects must queue to the GUI
+            thread, e.g. by emitting a signal.
+        """
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def get(self, key):
+        """
+        -o- data : the section data array, None if it is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.data
+
+    def put(self, key, data, nbytes=None):
+        """
+        -i- key : tuple, see section_key()
+        -i- data : the section data array, None to only hold nodes
+        -i- nbytes : int, memory of the data, default data.nbytes
+        """
+        if nbytes is None:
+            nbytes = 0 if data is None else int(data.nbytes)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = SectionEntry(data, nbytes)
+                self._entries[key] = entry
+            else:
+                self.nbytes -= entry.nbytes
+                entry.data = data
+                entry.nbytes = nbytes
+                self._entries.move_to_end(key)
+            self.nbytes += nbytes
+            evicted = self._evict(keep=key)
+        self._notify(evicted)
+
+    def get_or_make(self, key, make):
+        """
+        -i- make : function, make() returns the data on a miss
+        -o- data : the section data array
+        """
+        data = self.get(key)
+        if data is None:
+            data = make()
+            self.put(key, data)
+        return data
+
+    def get_node(self, key, parent):
+        """
+        -i- parent : string, viewer name
+        -o- node : the visual of the viewer, None if it has none
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry.nodes.get(parent)
+
+    def set_node(self, key, parent, node, nbytes=0):
+        """
+        -i- parent : string, viewer name
+        -i- node : the visual of the viewer
+        -i- nbytes : int, memory of the image data of node
+        If the viewer holds node under another key, it is moved from there.
+        """
+        with self._lock:
+            for old_key, entry in list(self._entries.items()):
+                if old_key != key and entry.nodes.get(parent) is node:
+                    self._pop_node(old_key, parent)
+            if key not in self._entries:
+                self._entries[key] = SectionEntry(None, 0)
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+            self.nbytes -= entry.node_nbytes.get(parent, 0)
+            entry.nodes[parent] = node
+            entry.node_nbytes[parent] = nbytes
+            self.nbytes += nbytes
+            evicted = self._evict(keep=key)
+        self._notify(evicted)
+
+    def _pop_node(self, key, parent):
+        """ Drop the node of parent, and the entry if nothing is left """
+        entry = self._entries[key]
+        node = entry.nodes.pop(parent, None)
+        self.nbytes -= entry.node_nbytes.pop(parent, 0)
+        if entry.data is None and len(entry.nodes) == 0:
+            self._entries.pop(key)
+            self.nbytes -= entry.nbytes
+        return node
+
+    def discard_nodes(self, parent):
+        """
+        Drop the nodes of a viewer, e.g. when it is closed. Entries left
+        with neither data nor nodes are removed.
+        -i- parent : string, viewer name
+        -o- nodes : list, of tuples (key, node) which were dropped
+        """
+        nodes = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if parent in entry.nodes:
+                    nodes.append((key, self._pop_node(key, parent)))
+        return nodes
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry.size()
+        if entry is not None:
+            self._notify([(key, entry)])
+
+    def discard_object(self, object_name, prop_name=None):
+        """ Drop the sections of a cube, or of one of its properties """
+        with self._lock:
+            keys = [k for k in self._entries if k[0] == object_name and
+                    (prop_name is None or k[1] == prop_name)]
+        for key in keys:
+            self.discard(key)
+
+    def clear(self):
+        with self._lock:
+            evicted = list(self._entries.items())
+            self._entries.clear()
+            self.nbytes = 0
+        self._notify(evicted)
+
+    def set_budget(self, budget):
+        with self._lock:
+            self.budget = budget
+            evicted = self._evict()
+        self._notify(evicted)
+
+    def _evict(self, keep=None):
+        """ Pop the least recently used entries until within the budget """
+        evicted = []
+        while self.nbytes > self.budget and len(self._entries) > 0:
+            key = next(iter(self._entries))
+            if key == keep:
+                # A single entry above the budget stays until replaced.
+                break
+            entry = self._entries.pop(key)
+            self.nbytes -= entry.size()
+            self.evictions += 1
+            evicted.append((key, entry))
+        return evicted
+
+    def _notify(self, evicted):
+        for key, entry in evicted:
+            for callback in list(self._callbacks):
+                try:
+                    callback(key, entry)
+                except Exception as e:
+                    logger.error('Section cache callback failed: {}'.format(
+                        e))
+
+    @property
+    def stats(self):
+        """
+        -o- stats : dict, hits, misses, hit_ratio, evictions, entries,
+            nodes, bytes and budget
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'nodes': sum(len(e.nodes) for e in self._entries.values()),
+                'bytes': self.nbytes,
+                'budget': self.budget,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+
+_cache = None
+
+
+def get_section_cache():
+    """ The section cache of the session, budget from the config """
+    global _cache
+    if _cache is None:
+        try:
+            from ezcad.config.main import CONF
+            budget_mb = CONF.get('image_viewer', 'section_cache_mb')
+        except Exception:
+            budget_mb = DEFAULT_BUDGET_MB
+        _cache = SectionCache(budget=int(budget_mb * MEGABYTE))
+    return _cache
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Background prefetch of the sections next to the displayed one.
+
+Moving to another section number extracts and color-maps the section on
+the GUI thread. After each move the SectionPrefetcher submits the next
+sections in the scroll direction, and one or two behind, to a thread
+pool; the results go into the shared section cache (see
+ezcad.utils.section_cache). Holding the arrow key then mostly finds the
+section ready, and waits for a pending one instead of computing it again.
+Sections which fall out of the window are cancelled if not yet started.
+
+make_section runs in the worker threads, so it must not use the sqlite
+connection of the GUI thread; cube arrays, memmaps and BrickReader with
+its own connection are fine. The puts also run the eviction callbacks of
+the cache on the workers.
+
+No viewer reads the prefetched sections yet: the image viewer still
+gets its images from the data objects (plot_image_vs), so nothing calls
+moved() or get() outside main() until the section extraction of the
+cubes is routed through get_or_make().
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import numpy as np
+from ezcad.utils.envars import NCORE
+from ezcad.utils.section_cache import get_section_cache, section_key
+from ezcad.utils.logger import logger
+
+PREFETCH_DEPTH = 4
+
+
+NAN_COLOR = (0, 0, 0, 0)  # transparent
+
+
+def map_colors(data, lut, clip, out=None, nan_color=NAN_COLOR):
+    """
+    -i- data : 2D array, section values
+    -i- lut : uint8 array, (n, 4) RGBA lookup table
+    -i- clip : tuple, (min, max) values of the first and last color
+    -i- out : uint8 array, data.shape + (4,), reused if given
+    -i- nan_color : tuple, RGBA of NaN values, e.g. masked samples
+    -o- rgba : uint8 array, data.shape + (4,)
+    """
+    vmin, vmax = clip
+    n = len(lut)
+    scale = (n - 1) / (vmax - vmin) if vmax != vmin else 0.0
+    index = (np.asarray(data, dtype=np.float32) - vmin) * scale
+    nan = np.isnan(index)
+    hasnan = nan.any()
+    if hasnan:
+        index[nan] = 0
+    np.clip(index, 0, n - 1, out=index)
+    index = index.astype(np.intp)
+    rgba = np.take(lut, index, axis=0, out=out)
+    if hasnan:
+        rgba[nan] = nan_color
+    return rgba
+
+
+class SectionPrefetcher:
+    """Prefetch sections of one cube property around the current one"""
+    def __init__(self, object_name, prop_name, make_section, ranges,
+                 gradient=None, clip=None, depth=PREFETCH_DEPTH,
+                 cache=None, max_workers=None):
+        """
+        -i- object_name : string, cube name
+        -i- prop_name : string, property name
+        -i- make_section : function, make_section(section_type, number)
+            returns the section, extracted and color-mapped
+        -i- ranges : dict, section type to (first, last, step) numbers
+        -i- gradient : dict, color gradient, part of the cache key
+        -i- clip : tuple, color clip, part of the cache key
+        -i- depth : int, sections prefetched ahead in the scroll direction
+        -i- cache : SectionCache, default the one of the session
+        -i- max_workers : int, threads, default half of NCORE, at least 2
+        """
+        self.object_name = object_name
+        self.prop_name = prop_name
+        self.make_section = make_section
+        self.ranges = ranges
+        self.gradient = gradient
+        self.clip = clip
+        self.depth = depth
+        self.cache = get_section_cache() if cache is None else cache
+        if max_workers is None:
+            max_workers = max(2, (NCORE or 4) // 2)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix='Prefetch')
+        self._pending = {}
+        self._last = {}
+        self._lock = threading.Lock()
+        self.prefetched = 0
+        self.cancelled = 0
+
+    def key(self, section_type, number):
+        return section_key(self.object_name, self.prop_name, section_type,
+                           number, self.gradient, self.clip)
+
+    def set_colormap(self, gradient=None, clip=None):
+        """ New color keys; prefetched sections of the old ones are kept
+        in the cache until evicted """
+        self.cancel()
+        self.gradient = gradient
+        self.clip = clip
+
+    def window(self, section_type, number):
+        """
+        -o- numbers : list, section numbers to prefetch, nearest first
+        """
+        first, last, step = self.ranges[section_type]
+        previous = self._last.get(section_type)
+        self._last[section_type] = number
+        direction = 0
+        if previous is not None and previous != number and \
+                abs(number - previous) <= self.depth * step:
+            direction = 1 if number > previous else -1
+        if direction == 0:
+            ahead = [1, -1] * max(1, self.depth // 2)
+            offsets = [s * (i // 2 + 1) for i, s in enumerate(ahead)]
+        else:
+            offsets = [direction * i for i in range(1, self.depth + 1)]
+            offsets += [-direction * i
+                        for i in range(1, max(1, self.depth // 4) + 1)]
+        numbers = [number + k * step for k in offsets]
+        return [n for n in numbers if first <= n <= last]
+
+    def moved(self, section_type, number):
+        """
+        Call after the viewer moved to section number, e.g. from
+        update_cube_secno. Submit the sections around it.
+        """
+        wanted = {self.key(section_type, n): n
+                  for n in self.window(section_type, number)}
+        with self._lock:
+            for key, future in list(self._pending.items()):
+                if key[2] == section_type and key not in wanted:
+                    if future.cancel():
+                        self._pending.pop(key)
+                        self.cancelled += 1
+            for key, n in wanted.items():
+                if key in self._pending or self.cache.has_data(key):
+                    continue
+                future = self._pool.submit(self._run, key, section_type, n)
+                self._pending[key] = future
+
+    def _run(self, key, section_type, number):
+        try:
+            data = self.make_section(section_type, number)
+            self.cache.put(key, data)
+            self.prefetched += 1
+            return data
+        except Exception as e:
+            logger.error('Failed prefetching {} {}: {}'.format(
+                section_type, number, e))
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def get(self, section_type, number, wait=True):
+        """
+        -i- wait : bool, wait for the section if it is being prefetched
+        -o- data : the section, None if it is neither cached nor pending
+        """
+        key = self.key(section_type, number)
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+        with self._lock:
+            future = self._pending.get(key)
+        if future is None or not wait:
+            return None
+        try:
+            return future.result()
+        except Exception:  # cancelled after the lookup
+            return None
+
+    def get_or_make(self, section_type, number):
+        """ The section, from the cache, a pending prefetch or made now,
+        then prefetch around it """
+        data = self.get(section_type, number)
+        if data is None:
+            data = self.make_section(section_type, number)
+            self.cache.put(self.key(section_type, number), data)
+        self.moved(section_type, number)
+        return data
+
+    def cancel(self):
+        with self._lock:
+            for key, future in list(self._pending.items()):
+                if future.cancel():
+                    self._pending.pop(key)
+                    self.cancelled += 1
+
+    def shutdown(self):
+        self.cancel()
+        self._pool.shutdown(wait=True)
+
+
+def main():
+    import time
+    from ezcad.utils.section_cache import SectionCache
+    cube = np.random.rand(300, 400, 500).astype(np.float32)
+    lut = np.random.randint(0, 255, (256, 4), dtype=np.uint8)
+
+    def make_section(section_type, number):
+        time.sleep(0.02)  # decoding bricks or reading from disk
+        return map_colors(cube[number], lut, (0, 1))
+
+    t0 = time.time()
+    for number in range(100):
+        make_section('iline', number)
+        time.sleep(0.01)
+    print('Scrolled 100 sections in {:.2f} s without prefetch'.format(
+        time.time() - t0))
+
+    prefetcher = SectionPrefetcher('cube', 'amp', make_section,
+                                   {'iline': (0, 299, 1)},
+                                   cache=SectionCache(budget=512 << 20))
+    t0 = time.time()
+    for number in range(100):
+        prefetcher.get_or_make('iline', number)
+        time.sleep(0.01)  # drawing the section
+    t1 = time.time()
+    print('Scrolled 100 sections in {:.2f} s, {} prefetched'.format(
+        t1 - t0, prefetcher.prefetched))
+    print(prefetcher.cache.stats)
+    prefetcher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
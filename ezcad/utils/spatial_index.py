@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Uniform grid hash of 2D points for picking.
+
+GridIndex buckets the points in square cells and sorts them by cell
+once. A box query only looks at the cells the box covers, each found by
+np.searchsorted, so a pick costs O(log n) plus the few points near the
+cursor instead of a mask over all vertexes.
+
+Building takes a sort of all points, so for a visual it is done in a
+background thread by request_index(); until the index is ready the
+caller falls back to the brute-force mask. The index is rebuilt when the
+vertex array of the visual is replaced; call invalidate_index() after
+editing the vertexes in place.
+"""
+
+import threading
+import weakref
+import numpy as np
+from ezcad.utils.logger import logger
+
+POINTS_PER_CELL = 8
+MAX_CELLS = 1 << 24
+
+
+class GridIndex:
+    """Uniform grid hash of 2D points"""
+    def __init__(self, xy, points_per_cell=POINTS_PER_CELL):
+        """
+        -i- xy : array, n by 2 or more columns, only x and y are used
+        -i- points_per_cell : int, average number of points per cell
+        """
+        x = np.ascontiguousarray(xy[:, 0], dtype=np.float64)
+        y = np.ascontiguousarray(xy[:, 1], dtype=np.float64)
+        npts = len(x)
+        self.npts = npts
+        if npts == 0:
+            self.xmin = self.ymin = 0.0
+            self.cell = 1.0
+            self.nx = self.ny = 1
+        else:
+            self.xmin, self.ymin = x.min(), y.min()
+            width = max(x.max() - self.xmin, y.max() - self.ymin, 1e-12)
+            ncell = min(max(1, npts // points_per_cell), MAX_CELLS)
+            # Square cells on the larger extent, at most MAX_CELLS of them.
+            area = max((x.max() - self.xmin) * (y.max() - self.ymin),
+                       width * width / ncell)
+            self.cell = max(np.sqrt(area / ncell), width / np.sqrt(MAX_CELLS))
+            self.nx = int((x.max() - self.xmin) // self.cell) + 1
+            self.ny = int((y.max() - self.ymin) // self.cell) + 1
+        keys = self._keys(x, y)
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+        self.x = x[self.order]
+        self.y = y[self.order]
+
+    def _cells(self, x, y):
+        cx = np.clip(((x - self.xmin) // self.cell).astype(np.int64),
+                     0, self.nx - 1)
+        cy = np.clip(((y - self.ymin) // self.cell).astype(np.int64),
+                     0, self.ny - 1)
+        return cx, cy
+
+    def _keys(self, x, y):
+        cx, cy = self._cells(x, y)
+        return cx * self.ny + cy
+
+    def _query(self, xmin, xmax, ymin, ymax):
+        """ Positions in the sorted arrays of the points in the box """
+        if self.npts == 0:
+            return np.empty(0, dtype=np.intp)
+        (cx0, cx1), (cy0, cy1) = self._cells(np.array([xmin, xmax]),
+                                             np.array([ymin, ymax]))
+        # One contiguous key run per column of cells
+        starts = np.arange(cx0, cx1 + 1) * self.ny
+        lo = np.searchsorted(self.keys, starts + cy0, side='left')
+        hi = np.searchsorted(self.keys, starts + cy1, side='right')
+        if np.sum(hi - lo) == 0:
+            return np.empty(0, dtype=np.intp)
+        cand = np.concatenate([np.arange(a, b) for a, b in zip(lo, hi)])
+        x, y = self.x[cand], self.y[cand]
+        inside = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        return cand[inside]
+
+    def query_box(self, xmin, xmax, ymin, ymax):
+        """
+        -o- index : int array, original index of the points in the box
+        """
+        return np.sort(self.order[self._query(xmin, xmax, ymin, ymax)])
+
+    def nearest_in_box(self, x, y, xmin, xmax, ymin, ymax):
+        """
+        -i- x, y : float, the picked position
+        -i- xmin, xmax, ymin, ymax : float, the tolerance box
+        -o- index : int, original index of the nearest point in the box,
+            None if the box is empty
+        """
+        pos = self._query(xmin, xmax, ymin, ymax)
+        if len(pos) == 0:
+            return None
+        dist = (self.x[pos] - x) ** 2 + (self.y[pos] - y) ** 2
+        # Nearest first, then the lowest index among equal distances
+        best = np.lexsort((self.order[pos], dist))[0]
+        return int(self.order[pos[best]])
+
+
+_indexes = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _vertex_key(visual):
+    vertexes = visual.vertexes
+    return (id(vertexes), len(vertexes),
+            vertexes.__array_interface__['data'][0])
+
+
+def _build(visual, key):
+    try:
+        index = GridIndex(visual.vertexes['xyz'])
+    except Exception as e:
+        logger.error('Failed building spatial index: {}'.format(e))
+        index = None
+    with _lock:
+        state = _indexes.get(visual)
+        if state is not None and state['key'] == key:
+            state['index'] = index
+
+
+def request_index(visual, background=True):
+    """
+    -i- visual : vispy visual with a vertexes structured array
+    -i- background : bool, build in a thread, otherwise build now
+    -o- index : GridIndex, None while it is being built
+    """
+    key = _vertex_key(visual)
+    with _lock:
+        state = _indexes.get(visual)
+        if state is not None and state['key'] == key:
+            return state['index']
+        state = {'key': key, 'index': None}
+        _indexes[visual] = state
+    if not background:
+        _build(visual, key)
+        return state['index']
+    threading.Thread(target=_build, args=(visual, key),
+                     name='SpatialIndex', daemon=True).start()
+    return None
+
+
+def invalidate_index(visual):
+    with _lock:
+        _indexes.pop(visual, None)
@@ -3,14 +3,146 @@
 
 """
 https://stackoverflow.com/questions/18621513/python-insert-numpy-array-into-sqlite3-database
+
+Arrays are stored as a versioned raw-buffer codec. A BLOB is laid out as
+
+    magic (4s) | version (B) | codec (B) | byte order (c) | ndim (B) |
+    descr length (H) | header length (H) | descr (ascii) | shape (ndim q) |
+    padding to 16 bytes | raw C-ordered buffer
+
+The header carries everything np.frombuffer needs, so encode and decode
+touch the array data exactly once. Blobs written by np.save (the previous
+adapter) start with the .npy magic and are still read through np.load.
 """
 
 import sqlite3
-import numpy as np
+import struct
+import time
 import io
+import numpy as np
+
+ARRAY_MAGIC = b'EZAR'
+ARRAY_VERSION = 1
+CODEC_RAW = 0
+
+_HEAD = struct.Struct('<4sBBcBHH')
+_ALIGN = 16
+
+
+def _is_raw_dtype(dtype):
+    """Structured and object dtypes cannot round trip through dtype.str"""
+    return dtype.fields is None and not dtype.hasobject
+
+
+def array_header(arr):
+    """
+    -i- arr : array, C-contiguous, of a plain (non-structured) dtype.
+    -o- header : bytes, codec header padded to a 16-byte boundary.
+    """
+    descr = arr.dtype.str.encode('ascii')
+    ndim = arr.ndim
+    size = _HEAD.size + len(descr) + 8 * ndim
+    size += -size % _ALIGN
+    order = arr.dtype.byteorder.encode('ascii')
+    header = bytearray(size)
+    _HEAD.pack_into(header, 0, ARRAY_MAGIC, ARRAY_VERSION, CODEC_RAW, order,
+                    ndim, len(descr), size)
+    offset = _HEAD.size
+    header[offset:offset+len(descr)] = descr
+    offset += len(descr)
+    struct.pack_into('<%dq' % ndim, header, offset, *arr.shape)
+    return bytes(header)
+
+
+def parse_header(blob):
+    """
+    -i- blob : bytes-like, starting with a codec header.
+    -o- dtype : numpy dtype
+    -o- shape : tuple, array shape
+    -o- offset : int, byte offset of the raw buffer
+    """
+    magic, version, codec, order, ndim, ndescr, offset = \
+        _HEAD.unpack_from(blob, 0)
+    if magic != ARRAY_MAGIC:
+        raise ValueError("Blob is not an ezcad array")
+    if version > ARRAY_VERSION:
+        raise ValueError("Unsupported array version {}".format(version))
+    if codec != CODEC_RAW:
+        raise ValueError("Unsupported array codec {}".format(codec))
+    start = _HEAD.size
+    descr = bytes(blob[start:start+ndescr]).decode('ascii')
+    shape = struct.unpack_from('<%dq' % ndim, blob, start + ndescr)
+    return np.dtype(descr), shape, offset
+
+
+def peek_header(blob):
+    """
+    -i- blob : bytes-like, the leading bytes of a BLOB, either codec.
+    -o- dtype : numpy dtype
+    -o- shape : tuple, array shape
+    Read the array dtype and shape without decoding the data.
+    """
+    if bytes(blob[:len(ARRAY_MAGIC)]) == ARRAY_MAGIC:
+        dtype, shape, offset = parse_header(blob)
+        return dtype, shape
+    fp = io.BytesIO(blob)
+    version = np.lib.format.read_magic(fp)
+    if version == (1, 0):
+        shape, fortran, dtype = np.lib.format.read_array_header_1_0(fp)
+    else:
+        shape, fortran, dtype = np.lib.format.read_array_header_2_0(fp)
+    return dtype, shape
+
+
+def encode_array(arr):
+    """
+    -i- arr : array
+    -o- blob : bytearray, header followed by the raw buffer.
+    The array data is copied once, straight into the output buffer.
+    """
+    if not arr.flags.c_contiguous:
+        arr = np.ascontiguousarray(arr)
+    header = array_header(arr)
+    blob = bytearray(len(header) + arr.nbytes)
+    blob[:len(header)] = header
+    if arr.nbytes > 0:
+        blob[len(header):] = memoryview(arr.reshape(-1).view(np.uint8))
+    return blob
+
+
+def decode_array(blob, copy=True):
+    """
+    -i- blob : bytes-like, written by encode_array or np.save.
+    -i- copy : bool, if False return a read-only view on blob.
+    -o- arr : array
+    """
+    if bytes(blob[:len(ARRAY_MAGIC)]) != ARRAY_MAGIC:
+        return convert_array_npy(blob)
+    dtype, shape, offset = parse_header(blob)
+    count = int(np.prod(shape, dtype=np.int64))
+    arr = np.frombuffer(blob, dtype=dtype, count=count, offset=offset)
+    arr = arr.reshape(shape)
+    if copy:
+        # np.frombuffer on bytes is read-only; one copy makes it writable.
+        out = np.empty(shape, dtype=dtype)
+        out[...] = arr
+        arr = out
+    return arr
 
 
 def adapt_array(arr):
+    """Adapter from array to sqlite BLOB"""
+    if not _is_raw_dtype(arr.dtype):
+        return adapt_array_npy(arr)
+    return sqlite3.Binary(encode_array(arr))
+
+
+def convert_array(text):
+    """Converter from sqlite BLOB to array"""
+    return decode_array(text)
+
+
+def adapt_array_npy(arr):
     """
     http://stackoverflow.com/a/31312102/190597 (SoulNibbler)
     """
@@ -20,12 +152,49 @@ def adapt_array(arr):
     return sqlite3.Binary(out.read())
 
 
-def convert_array(text):
+def convert_array_npy(text):
     out = io.BytesIO(text)
     out.seek(0)
     return np.load(out)
 
 
+def benchmark(shape=(200, 500, 500), repeat=3):
+    """
+    -i- shape : tuple, shape of the float32 test array
+    -i- repeat : int, number of runs; the best one is reported.
+    Compare MB/s of the npy adapter and the raw codec, inserting into and
+    selecting from an in-memory database.
+    """
+    x = np.random.rand(*shape).astype('float32')
+    mb = x.nbytes / 1e6
+    codecs = (('npy', adapt_array_npy, convert_array_npy),
+              ('raw', adapt_array, convert_array))
+    for name, adapter, converter in codecs:
+        sqlite3.register_adapter(np.ndarray, adapter)
+        sqlite3.register_converter("ARRAY", converter)
+        con = sqlite3.connect(":memory:",
+                              detect_types=sqlite3.PARSE_DECLTYPES)
+        cur = con.cursor()
+        cur.execute("CREATE TABLE test (arr ARRAY)")
+        save, load = [], []
+        for i in range(repeat):
+            cur.execute("DELETE FROM test")
+            t0 = time.perf_counter()
+            cur.execute("INSERT INTO test (arr) VALUES (?)", (x,))
+            t1 = time.perf_counter()
+            cur.execute("SELECT arr FROM test")
+            y = cur.fetchone()[0]
+            t2 = time.perf_counter()
+            save.append(t1 - t0)
+            load.append(t2 - t1)
+        assert np.array_equal(x, y), "Round trip is wrong"
+        con.close()
+        print('{}: save {:.0f} MB/s, load {:.0f} MB/s'.format(
+            name, mb / min(save), mb / min(load)))
+    sqlite3.register_adapter(np.ndarray, adapt_array)
+    sqlite3.register_converter("ARRAY", convert_array)
+
+
 def main():
     # Converts np.array to TEXT when inserting
     sqlite3.register_adapter(np.ndarray, adapt_array)
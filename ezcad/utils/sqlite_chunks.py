@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Streaming write and read of arrays split in chunks in sqlite tables.
+
+An array larger than SQLITE_LIMIT_LENGTH is split along the first axis
+and stored one chunk per row, keyed by the object name (and property
+name) plus chunkID starting from 1. Writing consumes the chunks from a
+generator. Reading first scans the chunk headers for the total shape,
+preallocates the output once and fills it chunk by chunk, so the memory
+overhead is bounded to one chunk instead of a copy of the whole array.
+"""
+
+import numpy as np
+from ezcad.utils.functions import iter_split_array
+from ezcad.utils.envars import SQLITE_LIMIT_LENGTH
+from ezcad.utils.sqlite_array import decode_array, peek_header
+
+# Enough for the codec header and the .npy header of old projects.
+HEADER_PEEK_LENGTH = 4096
+
+
+def chunk_query(table, key, select):
+    """
+    -i- table : string, table name
+    -i- key : dict, column name to value of the row key
+    -i- select : string, the selected columns
+    -o- sql : string
+    -o- params : tuple
+    """
+    where = ' AND '.join('{} = ?'.format(k) for k in key)
+    sql = 'SELECT {} FROM {} WHERE {} ORDER BY chunkID'.format(
+        select, table, where)
+    return sql, tuple(key.values())
+
+
+def iter_chunk_rows(name, array, name2=None, byteLimit=SQLITE_LIMIT_LENGTH):
+    """
+    Split array ready for insert to sqlite, one row at a time.
+    The rows are the same as those of DBSQLite.__split_array.
+    """
+    splits = iter_split_array(array, byteLimit)
+    for i, chunkArray in enumerate(splits):
+        chunkID = i + 1
+        if name2 is None:
+            yield (name, chunkID, chunkArray)
+        else:
+            yield (name, name2, chunkID, chunkArray)
+
+
+def insert_array(cursor, table, name, array, name2=None):
+    """
+    -i- cursor : sqlite cursor
+    -i- table : string, table with columns (name, [name2,] chunkID, arr)
+    Insert the array chunks, encoding one chunk at a time.
+    """
+    ncol = 3 if name2 is None else 4
+    sql = 'INSERT INTO {} VALUES ({})'.format(table, ','.join('?' * ncol))
+    cursor.executemany(sql, iter_chunk_rows(name, array, name2))
+
+
+def read_blob_head(connect, table, column, rowid, length=HEADER_PEEK_LENGTH):
+    """
+    -i- connect : sqlite connection
+    -i- rowid : int, rowid of the row
+    -o- head : bytes, the leading bytes of the BLOB
+    Only the pages of the head are read, while substr() on a BLOB loads
+    all of it.
+    """
+    with connect.blobopen(table, column, rowid, readonly=True) as blob:
+        return blob.read(length)
+
+
+def iter_blob_heads(cursor, table, column, sql, params, prefix=''):
+    """
+    -i- table : string, table of the BLOBs
+    -i- column : string, column of the BLOBs
+    -i- sql : string, query whose last selected column is '{}', the head
+        of the BLOB, e.g. 'SELECT chunkID, {} FROM ...'
+    -i- prefix : string, alias of table in sql, e.g. 'b.'
+    -o- rows : iterator of the rows, the head is None if the BLOB is NULL
+    Without Connection.blobopen (Python < 3.11) the heads fall back to
+    substr(), which reads the whole BLOBs.
+    """
+    connect = cursor.connection
+    if not hasattr(connect, 'blobopen'):
+        head = 'substr({}{}, 1, {})'.format(prefix, column,
+                                           HEADER_PEEK_LENGTH)
+        cursor.execute(sql.format(head), params)
+        yield from cursor
+        return
+    cursor.execute(sql.format(prefix + 'rowid'), params)
+    for row in cursor.fetchall():
+        rowid = row[-1]
+        head = None
+        if rowid is not None:
+            head = read_blob_head(connect, table, column, rowid)
+        yield row[:-1] + (head,)
+
+
+def read_chunk_headers(cursor, table, key, column='arr'):
+    """
+    -o- dtype : numpy dtype of the chunks
+    -o- shapes : list, shape of each chunk in chunkID order
+    """
+    sql, params = chunk_query(table, key, 'chunkID, {}')
+    dtype = None
+    shapes = []
+    rows = iter_blob_heads(cursor, table, column, sql, params)
+    for i, (chunkID, head) in enumerate(rows):
+        assert chunkID == (i+1), "Chunk order is wrong"
+        chunkDtype, shape = peek_header(head)
+        if dtype is None:
+            dtype = chunkDtype
+        elif chunkDtype != dtype:
+            raise ValueError("Chunks have different dtypes")
+        shapes.append(tuple(shape))
+    return dtype, shapes
+
+
+def cat_array(cursor, table, key, column='arr'):
+    """
+    -i- cursor : sqlite cursor
+    -i- table : string, table name
+    -i- key : dict, column name to value of the row key,
+        e.g. {'object_name': 'cube1', 'prop_name': 'vint'}
+    -i- column : string, column of the array chunks
+    -o- array : array, the chunks concatenated along the first axis
+    """
+    dtype, shapes = read_chunk_headers(cursor, table, key, column)
+    if len(shapes) == 0:
+        raise ValueError("No chunk is found for {}".format(key))
+    if len(shapes) == 1:
+        # Also covers 0-d arrays, which cannot be concatenated.
+        shape = shapes[0]
+    else:
+        for s in shapes[1:]:
+            if s[1:] != shapes[0][1:]:
+                raise ValueError("Chunks have different shapes")
+        shape = (sum(s[0] for s in shapes),) + shapes[0][1:]
+    out = np.empty(shape, dtype=dtype)
+
+    # Cast to BLOB, so no converter runs and the chunk is decoded as a
+    # read-only view, then copied straight into the output.
+    select = 'chunkID, CAST({} AS BLOB)'.format(column)
+    cursor.execute(*chunk_query(table, key, select))
+    start = 0
+    for i, (chunkID, blob) in enumerate(cursor):
+        assert chunkID == (i+1), "Chunk order is wrong"
+        chunk = decode_array(blob, copy=False)
+        if chunk.ndim == 0:
+            out[...] = chunk
+            continue
+        stop = start + chunk.shape[0]
+        out[start:stop] = chunk
+        start = stop
+        del blob, chunk
+    return out
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Bin scattered points on the survey IL/XL grid.
+
+SurveyBinner maps points to IL/XL bins with one SurveyTransform matrix
+multiply, then reduces the values of each bin: count and sum by
+np.bincount, min and max by np.minimum/maximum.at, which is fast since
+numpy 1.25; older numpy sorts on the bin index and uses reduceat. The
+statistics are accumulated, so the points can be added chunk by chunk,
+e.g. from a memmap, and the mean comes from the totals at the end. The
+count grid is the fold map.
+
+The grids are 2D arrays (number of ilines, number of xlines), the shape
+of a Gsurface property on the same line ranges.
+"""
+
+import time
+import numpy as np
+from ezcad.utils.survey_transform import SurveyTransform, get_transform
+
+STATISTICS = ('count', 'sum', 'mean', 'min', 'max')
+CHUNK_POINTS = 1 << 20
+# ufunc.at got its fast path in numpy 1.25
+_FAST_UFUNC_AT = tuple(int(v) for v in np.__version__.split('.')[:2]) \
+    >= (1, 25)
+
+
+def survey_line_range(dict_sgmt):
+    """
+    -i- dict_sgmt : dictionary, survey geometry
+    -o- il_range : tuple, (first, last) iline number
+    -o- xl_range : tuple, (first, last) xline number
+    """
+    ilnos = [dict_sgmt[p + '_ILNO'] for p in ('P1', 'P2', 'P3')]
+    xlnos = [dict_sgmt[p + '_XLNO'] for p in ('P1', 'P2', 'P3')]
+    return (min(ilnos), max(ilnos)), (min(xlnos), max(xlnos))
+
+
+class SurveyBinner:
+    """Accumulate point statistics per IL/XL bin"""
+    def __init__(self, survey=None, transform=None, il_range=None,
+                 xl_range=None, il_step=1, xl_step=1, rounding='nearest'):
+        """
+        -i- survey : Survey, or give transform and the line ranges
+        -i- transform : SurveyTransform
+        -i- il_range : tuple, (first, last) iline, default the survey
+        -i- xl_range : tuple, (first, last) xline, default the survey
+        -i- il_step, xl_step : int, line increment of the grid
+        -i- rounding : string, rounding of SurveyTransform.to_ln
+        """
+        if transform is None:
+            if survey is None:
+                raise ValueError("Must provide either survey or transform.")
+            transform = get_transform(survey)
+        if il_range is None or xl_range is None:
+            if survey is None:
+                raise ValueError("Must provide the line ranges.")
+            il_survey, xl_survey = survey_line_range(survey.geometry)
+            il_range = il_survey if il_range is None else il_range
+            xl_range = xl_survey if xl_range is None else xl_range
+        self.transform = transform
+        self.rounding = rounding
+        self.il_first, self.il_step = il_range[0], il_step
+        self.xl_first, self.xl_step = xl_range[0], xl_step
+        self.nil = (il_range[1] - il_range[0]) // il_step + 1
+        self.nxl = (xl_range[1] - xl_range[0]) // xl_step + 1
+        self.ilno_axis = self.il_first + il_step * np.arange(self.nil)
+        self.xlno_axis = self.xl_first + xl_step * np.arange(self.nxl)
+        self.reset()
+
+    def reset(self):
+        nbin = self.nil * self.nxl
+        self._count = np.zeros(nbin, dtype=np.int64)
+        self._sum = np.zeros(nbin, dtype=np.float64)
+        self._min = np.full(nbin, np.inf)
+        self._max = np.full(nbin, -np.inf)
+        self.outside = 0
+
+    def bin_index(self, points_ln):
+        """
+        -i- points_ln : array, n by 2 [ilno, xlno]
+        -o- index : int array, flat bin index, -1 outside the grid
+        """
+        i = points_ln[:, 0] - self.il_first
+        j = points_ln[:, 1] - self.xl_first
+        if self.il_step != 1:
+            i, ri = np.divmod(i, self.il_step)
+        if self.xl_step != 1:
+            j, rj = np.divmod(j, self.xl_step)
+        inside = (i >= 0) & (i < self.nil) & (j >= 0) & (j < self.nxl)
+        if self.il_step != 1:
+            inside &= ri == 0
+        if self.xl_step != 1:
+            inside &= rj == 0
+        return np.where(inside, i * self.nxl + j, -1)
+
+    def add_ln(self, points_ln, values=None):
+        """
+        -i- points_ln : array, n by 2 [ilno, xlno], integer line numbers
+        -i- values : array, n values, None only counts the points.
+            NaN values are not counted.
+        """
+        index = self.bin_index(np.asarray(points_ln))
+        if values is not None:
+            values = np.asarray(values, dtype=np.float64)
+            index[np.isnan(values)] = -1
+        keep = index >= 0
+        self.outside += int(len(index) - np.count_nonzero(keep))
+        index = index[keep]
+        nbin = len(self._count)
+        self._count += np.bincount(index, minlength=nbin)
+        if values is None:
+            return
+        values = values[keep]
+        self._sum += np.bincount(index, weights=values, minlength=nbin)
+        if len(index) == 0:
+            return
+        if _FAST_UFUNC_AT:
+            np.minimum.at(self._min, index, values)
+            np.maximum.at(self._max, index, values)
+            return
+        order = np.argsort(index, kind='stable')
+        index = index[order]
+        values = values[order]
+        starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+        bins = index[starts]
+        np.minimum.at(self._min, bins, np.minimum.reduceat(values, starts))
+        np.maximum.at(self._max, bins, np.maximum.reduceat(values, starts))
+
+    def add(self, points_xy, values=None, chunk=CHUNK_POINTS):
+        """
+        -i- points_xy : array or memmap, n by 2 or more columns [x, y, ...]
+        -i- values : array or memmap, n values, None only counts.
+        -i- chunk : int, points converted at a time
+        """
+        out = None
+        for start in range(0, len(points_xy), chunk):
+            stop = start + chunk
+            block = np.asarray(points_xy[start:stop])
+            if out is None or len(out) != len(block):
+                out = np.empty((len(block), 2), dtype=np.int64)
+            self.transform.to_ln(block, out=out, rounding=self.rounding)
+            part = None if values is None else values[start:stop]
+            self.add_ln(out, part)
+
+    def grid(self, statistic='count'):
+        """
+        -i- statistic : string, count, sum, mean, min or max
+        -o- grid : 2D array, (nil, nxl); empty bins are NaN except for
+            count and sum, which are zero.
+        """
+        if statistic not in STATISTICS:
+            raise ValueError("Unknown statistic {}".format(statistic))
+        empty = self._count == 0
+        if statistic == 'count':
+            out = self._count.copy()
+        elif statistic == 'sum':
+            out = self._sum.copy()
+        elif statistic == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out = self._sum / self._count
+            out[empty] = np.nan
+        else:
+            out = (self._min if statistic == 'min' else self._max).copy()
+            out[empty] = np.nan
+        return out.reshape(self.nil, self.nxl)
+
+
+def benchmark(npoints=20000000):
+    """
+    -i- npoints : int, number of random points
+    Bin random points on a 1000 by 1000 line survey, in chunks.
+    """
+    transform = SurveyTransform(
+        {'P1_ILNO': 1, 'P1_XLNO': 1, 'P1_CRSX': 0.0, 'P1_CRSY': 0.0},
+        {'iline': (0.0, 25.0), 'xline': (12.5, 0.0)})
+    binner = SurveyBinner(transform=transform, il_range=(1, 1000),
+                          xl_range=(1, 1000))
+    points = np.random.uniform((0, 0), (12500, 25000), (npoints, 2))
+    values = np.random.rand(npoints)
+    t0 = time.perf_counter()
+    binner.add(points, values)
+    grids = {stat: binner.grid(stat) for stat in STATISTICS}
+    seconds = time.perf_counter() - t0
+    print('Binned {} points in {:.2f} s, {:.1f} M points/s'.format(
+        npoints, seconds, npoints / seconds / 1e6))
+    print('Fold min {} max {}, outside {}'.format(
+        grids['count'].min(), grids['count'].max(), binner.outside))
+
+
+def main():
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
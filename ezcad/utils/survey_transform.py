@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+Cached affine transform between survey line numbers and coordinates.
+
+convert_grid.xy2ln and ln2xy prepare the survey steps at every call. The
+forward equations
+
+    X = Xij + (m-i)*ILDX + (n-j)*XLDX
+    Y = Yij + (m-i)*ILDY + (n-j)*XLDY
+
+are affine, so a SurveyTransform holds them once as a 2x3 matrix, with
+its inverse, and a batch of points is converted by one matrix multiply.
+Use get_transform(survey), which rebuilds the transform when the survey
+geometry or step changes.
+
+For very large point sets, to_xy_chunked and to_ln_chunked convert
+blocks of points on a thread pool into one preallocated output. Each
+block only needs a block-sized scratch buffer, and the input and output
+can be memmaps, so the points never have to fit in memory.
+"""
+
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from ezcad.utils.convert_grid import get_step, xy2ln_base
+from ezcad.utils.envars import NCORE
+
+ROUNDING_MODES = ('legacy', 'nearest', None)
+# Points per block, 64K points of 2 float64 is 1 MB, fits the L2 cache.
+BLOCK_POINTS = 1 << 16
+
+
+class SurveyTransform:
+    """Forward (line to xy) and inverse (xy to line) affine matrices"""
+    def __init__(self, dict_sgmt, dict_step=None):
+        """
+        -i- dict_sgmt : dictionary, survey geometry
+        -i- dict_step : dictionary, survey step, from the geometry if None
+        """
+        if dict_step is None:
+            ILDX, ILDY, XLDX, XLDY = get_step(dict_sgmt)
+        else:
+            ILDX, ILDY = dict_step['iline']
+            XLDX, XLDY = dict_step['xline']
+        i = dict_sgmt['P1_ILNO']
+        j = dict_sgmt['P1_XLNO']
+        Xij = dict_sgmt['P1_CRSX']
+        Yij = dict_sgmt['P1_CRSY']
+        self.step = (ILDX, ILDY, XLDX, XLDY)
+
+        # [X, Y] = forward @ [m, n, 1]
+        self.forward = np.array([
+            [ILDX, XLDX, Xij - i * ILDX - j * XLDX],
+            [ILDY, XLDY, Yij - i * ILDY - j * XLDY]], dtype=np.float64)
+        linear = np.linalg.inv(self.forward[:, :2])
+        self.inverse = np.hstack((linear, -linear @ self.forward[:, 2:]))
+
+        # convert_grid.xy2ln_base adds 0.5 to n before it derives m from
+        # n, so the legacy m is shifted by -0.5*XLDY/ILDY (or XLDX/ILDX).
+        # Still affine, so it is folded into a matrix with the +0.5 terms.
+        dn = ILDY * XLDX - ILDX * XLDY
+        nX, nY = ILDY / dn, -ILDX / dn
+        nC = j + (ILDX * Yij - ILDY * Xij) / dn + 0.5
+        if ILDY != 0:
+            mX = -nX * XLDY / ILDY
+            mY = (1 - nY * XLDY) / ILDY
+            mC = i + (-Yij - (nC - j) * XLDY) / ILDY + 0.5
+        else:
+            # IL is parallel to X-axis, use ILDX instead.
+            mX = (1 - nX * XLDX) / ILDX
+            mY = -nY * XLDX / ILDX
+            mC = i + (-Xij - (nC - j) * XLDX) / ILDX + 0.5
+        self.inverse_legacy = np.array([[mX, mY, mC], [nX, nY, nC]],
+                                       dtype=np.float64)
+        self._local = threading.local()
+
+    def _work(self, shape):
+        """ Float scratch buffer of this thread, reused between calls;
+        at most BLOCK_POINTS rows, see to_ln """
+        work = getattr(self._local, 'work', None)
+        if work is None or work.shape[0] < shape[0]:
+            work = np.empty(shape, dtype=np.float64)
+            self._local.work = work
+        return work[:shape[0]]
+
+    @staticmethod
+    def _apply(matrix, points, out):
+        """ out = points[:, :2] @ matrix[:, :2].T + matrix[:, 2] """
+        np.matmul(points[:, :2], matrix[:, :2].T, out=out)
+        out += matrix[:, 2]
+        return out
+
+    def to_xy(self, points, out=None):
+        """
+        -i- points : array, n by 2 or more columns [ilno, xlno, ...], or
+            one point [ilno, xlno]
+        -i- out : array, n by 2 float, reused for the result
+        -o- points_xy : array, n by 2, each element is [x, y]
+        """
+        points = np.asarray(points)
+        single = points.ndim == 1
+        if single:
+            points = points[np.newaxis]
+        if out is None:
+            out = np.empty((len(points), 2), dtype=np.float64)
+        self._apply(self.forward, points, out)
+        return out[0] if single else out
+
+    def to_ln(self, points, out=None, rounding='legacy'):
+        """
+        -i- points : array, n by 2 or more columns [x, y, ...], or one
+            point [x, y]
+        -i- out : array, n by 2, reused for the result. Integer for the
+            rounding modes, float for rounding None.
+        -i- rounding : string, 'legacy' matches convert_grid.xy2ln,
+            'nearest' rounds to the nearest line, None keeps fractional
+            line numbers.
+        -o- points_ln : array, n by 2, each element is [ilno, xlno]
+        """
+        if rounding not in ROUNDING_MODES:
+            raise ValueError("Unknown rounding {}".format(rounding))
+        points = np.asarray(points)
+        single = points.ndim == 1
+        if single:
+            points = points[np.newaxis]
+        npts = len(points)
+        if rounding is None:
+            if out is None:
+                out = np.empty((npts, 2), dtype=np.float64)
+            self._apply(self.inverse, points, out)
+            return out[0] if single else out
+
+        if out is None:
+            out = np.empty((npts, 2), dtype=int)
+        if out.dtype.kind != 'f' and npts > BLOCK_POINTS:
+            # Integer output goes through the float scratch buffer, which
+            # is kept per thread, so convert in blocks to bound its size.
+            for start in range(0, npts, BLOCK_POINTS):
+                stop = start + BLOCK_POINTS
+                self.to_ln(points[start:stop], out=out[start:stop],
+                           rounding=rounding)
+            return out[0] if single else out
+        work = out if out.dtype.kind == 'f' else self._work((npts, 2))
+        if rounding == 'legacy':
+            self._apply(self.inverse_legacy, points, work)
+            np.trunc(work, out=work)  # as astype(int)
+        else:
+            self._apply(self.inverse, points, work)
+            np.rint(work, out=work)
+        if work is not out:
+            out[...] = work
+        return out[0] if single else out
+
+    def _chunked(self, func, points, out, block, max_workers, **kwargs):
+        npts = len(points)
+        if max_workers is None:
+            max_workers = max(1, (NCORE or 1))
+        starts = range(0, npts, block)
+        if max_workers == 1 or len(starts) == 1:
+            for start in starts:
+                stop = start + block
+                func(points[start:stop], out=out[start:stop], **kwargs)
+            return out
+
+        def run(start):
+            stop = start + block
+            # numpy releases the GIL in matmul and the ufuncs.
+            func(points[start:stop], out=out[start:stop], **kwargs)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for f in [pool.submit(run, start) for start in starts]:
+                f.result()
+        return out
+
+    def to_xy_chunked(self, points, out=None, block=BLOCK_POINTS,
+                      max_workers=None):
+        """
+        -i- points : array or memmap, n by 2 or more columns
+        -i- out : array or memmap, n by 2 float, preallocated output
+        -i- block : int, points per block
+        -i- max_workers : int, threads, default from NCORE
+        -o- points_xy : out
+        """
+        if out is None:
+            out = np.empty((len(points), 2), dtype=np.float64)
+        return self._chunked(self.to_xy, points, out, block, max_workers)
+
+    def to_ln_chunked(self, points, out=None, rounding='legacy',
+                      block=BLOCK_POINTS, max_workers=None):
+        """
+        -i- points : array or memmap, n by 2 or more columns
+        -i- out : array or memmap, n by 2, preallocated output
+        -i- rounding : string, see to_ln
+        -i- block : int, points per block
+        -i- max_workers : int, threads, default from NCORE
+        -o- points_ln : out
+        """
+        if out is None:
+            dtype = np.float64 if rounding is None else int
+            out = np.empty((len(points), 2), dtype=dtype)
+        return self._chunked(self.to_ln, points, out, block, max_workers,
+                             rounding=rounding)
+
+
+def survey_key(survey):
+    """ Values the transform is built from, to detect geometry changes """
+    geometry = tuple(sorted(survey.geometry.items()))
+    step = getattr(survey, 'step', None)
+    if step is not None:
+        step = (tuple(step['iline']), tuple(step['xline']))
+    return geometry, step
+
+
+def get_transform(survey):
+    """
+    -i- survey : Survey
+    -o- transform : SurveyTransform, cached on the survey and rebuilt when
+        its geometry or step changes.
+    """
+    key = survey_key(survey)
+    cached = getattr(survey, '_survey_transform', None)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    transform = SurveyTransform(survey.geometry,
+                                getattr(survey, 'step', None))
+    survey._survey_transform = (key, transform)
+    return transform
+
+
+def invalidate_transform(survey):
+    """ Drop the cached transform, e.g. after editing the geometry """
+    survey._survey_transform = None
+
+
+def benchmark(npoints=10000000, repeat=3):
+    """
+    -i- npoints : int, number of random points
+    -i- repeat : int, number of runs; the best one is reported.
+    Compare points/s and peak traced memory of convert_grid.xy2ln_base
+    and SurveyTransform, plain and chunked.
+    """
+    dict_sgmt = {
+        'P1_ILNO': 100, 'P1_XLNO': 200, 'P1_CRSX': 500000.0,
+        'P1_CRSY': 6000000.0,
+        'P2_ILNO': 100, 'P2_XLNO': 1200, 'P2_CRSX': 511942.0,
+        'P2_CRSY': 6003694.0,
+        'P3_ILNO': 900, 'P3_XLNO': 200, 'P3_CRSX': 494089.0,
+        'P3_CRSY': 6019106.0}
+    transform = SurveyTransform(dict_sgmt)
+    points_ln = np.random.uniform((100, 200), (900, 1200), (npoints, 2))
+    points_xy = transform.to_xy(points_ln)
+    out = np.empty((npoints, 2), dtype=int)
+    cases = (
+        ('xy2ln_base', lambda: xy2ln_base(points_xy, dict_sgmt)),
+        ('to_ln', lambda: transform.to_ln(points_xy, out=out)),
+        ('to_ln_chunked', lambda: transform.to_ln_chunked(points_xy,
+                                                          out=out)),
+    )
+    expected = None
+    for name, func in cases:
+        seconds, peak = [], []
+        for i in range(repeat):
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            result = func()
+            seconds.append(time.perf_counter() - t0)
+            peak.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        if expected is None:
+            expected = result.copy()
+        else:
+            assert np.array_equal(result, expected), "Result is different"
+        del result
+        print('{}: {:.1f} M points/s, peak {:.1f} MB'.format(
+            name, npoints / min(seconds) / 1e6, min(peak) / 1e6))
+
+
+def main():
+    benchmark()
+
+
+if __name__ == '__main__':
+    main()
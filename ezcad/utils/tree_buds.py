@@ -9,6 +9,8 @@ from ezcad.dialogs.camera_operator import Dialog as CameraOperatorDialog
 from ezcad.widgets.dialogs import PropertyOperatorDialog, RenameObjectDialog, \
     CopyObjectDialog, RemoveObjectDialog, CreatePropertyDialog, \
     RenamePropertyDialog, RemovePropertyDialog, ConfigDialog
+from ezcad.utils.dirty_state import mark_dirty, mark_renamed, ADDED, REMOVED
+from ezcad.utils.property_stats import invalidate_stats
 
 
 class Buds:
@@ -39,12 +41,19 @@ class Buds:
     def property_operation(self, object_name, script):
         self.dob = self.base.object_data[object_name]
         prop_names = list(self.dob.prop.keys())
+        used_names = []
         for prop_name in prop_names:
             if prop_name in script:
                 new = "self.dob.prop['%s'][self.dob.prop_array_key][:]"\
                       % prop_name
                 script = script.replace(prop_name, new)
+                used_names.append(prop_name)
         exec(script)
+        # The script may assign to any property it mentions, in place, so
+        # the array is the same object and its cached statistics are stale.
+        for prop_name in used_names:
+            mark_dirty(self.dob, prop_name)
+            invalidate_stats(self.dob.prop[prop_name])
         # TODO update property-related values, color, clip, etc.
 
     def open_camera_operator(self):
@@ -52,14 +61,44 @@ class Buds:
         dialog.load_from_viewer()
         dialog.show()
 
+    # The tree base does the edits; these flag them for the next save.
+    def rename_object(self, object_name, new_name):
+        self.base.rename_object(object_name, new_name)
+        if new_name in self.base.object_data:
+            mark_dirty(self.base.object_data[new_name])
+
+    def copy_object(self, object_name, new_name):
+        self.base.copy_object(object_name, new_name)
+        if new_name in self.base.object_data:
+            # A copy also copies the clean flags of its source.
+            mark_dirty(self.base.object_data[new_name])
+
+    def rename_property(self, object_name, prop_name, new_name):
+        self.base.rename_property(object_name, prop_name, new_name)
+        dob = self.base.object_data[object_name]
+        if new_name in dob.prop and prop_name not in dob.prop:
+            mark_renamed(dob, prop_name, new_name)
+
+    def remove_property(self, object_name, prop_name):
+        self.base.remove_property(object_name, prop_name)
+        dob = self.base.object_data[object_name]
+        if prop_name not in dob.prop:
+            mark_dirty(dob, prop_name, action=REMOVED)
+
+    def create_property(self, object_name, prop_name):
+        self.base.create_property(object_name, prop_name)
+        dob = self.base.object_data[object_name]
+        if prop_name in dob.prop:
+            mark_dirty(dob, prop_name, action=ADDED)
+
     def open_rename_object(self):
         dialog = RenameObjectDialog(self.base)
-        dialog.sig_start.connect(self.base.rename_object)
+        dialog.sig_start.connect(self.rename_object)
         dialog.show()
 
     def open_copy_object(self):
         dialog = CopyObjectDialog(self.base)
-        dialog.sig_start.connect(self.base.copy_object)
+        dialog.sig_start.connect(self.copy_object)
         dialog.show()
 
     def open_remove_object(self):
@@ -69,35 +108,35 @@ class Buds:
 
     def open_rename_property(self):
         dialog = RenamePropertyDialog(self.base)
-        dialog.sig_start.connect(self.base.rename_property)
+        dialog.sig_start.connect(self.rename_property)
         dialog.show()
 
     def open_remove_property(self):
         dialog = RemovePropertyDialog(self.base)
-        dialog.sig_start.connect(self.base.remove_property)
+        dialog.sig_start.connect(self.remove_property)
         dialog.show()
  
     def open_create_property(self):
         dialog = CreatePropertyDialog(self.base)
-        dialog.sig_start.connect(self.base.create_property)
+        dialog.sig_start.connect(self.create_property)
         dialog.show()
 
     def create_property_rc(self):
         dialog = CreatePropertyDialog(self.base)
         dialog.grab_object_rc()
-        dialog.sig_start.connect(self.base.create_property)
+        dialog.sig_start.connect(self.create_property)
         dialog.show()
 
     def rename_object_rc(self):
         dialog = RenameObjectDialog(self.base)
         dialog.grab_object_rc()
-        dialog.sig_start.connect(self.base.rename_object)
+        dialog.sig_start.connect(self.rename_object)
         dialog.show()
 
     def copy_object_rc(self):
         dialog = CopyObjectDialog(self.base)
         dialog.grab_object_rc()
-        dialog.sig_start.connect(self.base.copy_object)
+        dialog.sig_start.connect(self.copy_object)
         dialog.show()
 
     def __preference_page_changed(self, index):
@@ -131,3 +170,5 @@ class Buds:
         # dlg.check_all_settings()
         dlg.pages_widget.currentChanged.connect(self.__preference_page_changed)
         dlg.exec_()
+        # The pages may have applied style changes before any cancel.
+        mark_dirty(dob)
@@ -15,6 +15,7 @@ Some customization to the pyqtgraph.GradientEditorItem
         because ColorMap does not support HSV mode yet.
 """
 
+from collections import OrderedDict
 import numpy as np
 from pyqtgraph.Qt import QtCore, QtGui
 from pyqtgraph.graphicsItems.GradientEditorItem import TickSliderItem, \
@@ -23,6 +24,47 @@ from pyqtgraph.colormap import ColorMap
 import pyqtgraph.functions as fn
 from ezcad.utils.colorbar_gradients import Gradients as customGradients
 
+LUT_CACHE_SIZE = 8
+USHRT_MAX = 65535
+
+
+def _qround(d):
+    """ qRound of non-negative doubles """
+    return np.floor(d + 0.5).astype(np.int64)
+
+
+def hsv_to_rgb(h, s, v):
+    """
+    -i- h, s, v : int arrays, as taken by QColor.setHsv, h is -1 for
+        achromatic colors
+    -o- r, g, b : int arrays, QColor.red(), green() and blue() after
+        setHsv, following the conversion in Qt 5 QColor::toRgb()
+    """
+    h = np.asarray(h, dtype=np.int64)
+    hue = np.where(h == -1, USHRT_MAX, (h % 360) * 100)
+    sat = np.asarray(s, dtype=np.int64) * 0x101
+    val = np.asarray(v, dtype=np.int64) * 0x101
+    hh = np.where(hue == 36000, 0, hue) / 6000.
+    ss = sat / float(USHRT_MAX)
+    vv = val / float(USHRT_MAX)
+    i = hh.astype(np.int64)
+    f = hh - i
+    p = vv * (1.0 - ss)
+    q = vv * (1.0 - (ss * f))
+    t = vv * (1.0 - (ss * (1.0 - f)))
+    # (red, green, blue) for each sector i of the hue
+    sectors = [(vv, t, p), (q, vv, p), (p, vv, t),
+               (p, q, vv), (t, p, vv), (vv, p, q)]
+    index = np.clip(i, 0, 5)
+    achromatic = (sat == 0) | (hue == USHRT_MAX)
+    rgb = []
+    for k in range(3):
+        c = np.choose(index, [sector[k] for sector in sectors])
+        c16 = np.where(achromatic, val, _qround(c * USHRT_MAX))
+        c16 = c16 + 0x80
+        rgb.append((c16 - (c16 >> 8)) >> 8)  # qt_div_257
+    return rgb
+
 
 class GradientEditorItem(TickSliderItem):
     """
@@ -68,6 +110,7 @@ class GradientEditorItem(TickSliderItem):
             QtCore.QRectF(0, -self.rectSize, 100, self.rectSize))
         self.backgroundRect.setBrush(QtGui.QBrush(QtCore.Qt.DiagCrossPattern))
         self.colorMode = 'rgb'
+        self.luts = OrderedDict()  # lookup tables by gradient state
 
         TickSliderItem.__init__(self, *args, **kargs)
 
@@ -341,7 +384,7 @@ class GradientEditorItem(TickSliderItem):
             s = s1 * (1. - f) + s2 * f
             v = v1 * (1. - f) + v2 * f
             c = QtGui.QColor()
-            c.setHsv(h, s, v)
+            c.setHsv(int(h), int(s), int(v))
             if toQColor:
                 return c
             else:
@@ -360,17 +403,56 @@ class GradientEditorItem(TickSliderItem):
         """
         if alpha is None:
             alpha = self.usesAlpha()
-        if alpha:
-            table = np.empty((nPts, 4), dtype=np.ubyte)
+        ticks = self.listTicks()
+        state = tuple((x, t.color.rgba()) for t, x in ticks)
+        key = (nPts, bool(alpha), self.colorMode, state)
+        table = self.luts.get(key)
+        if table is None:
+            table = self.makeLookupTable(ticks, nPts, alpha)
+            self.luts[key] = table
+            if len(self.luts) > LUT_CACHE_SIZE:
+                self.luts.popitem(last=False)
         else:
-            table = np.empty((nPts, 3), dtype=np.ubyte)
-
-        for i in range(nPts):
-            x = float(i) / (nPts - 1)
-            color = self.getColor(x, toQColor=False)
-            table[i] = color[:table.shape[1]]
+            self.luts.move_to_end(key)
+        return table.copy()
 
-        return table
+    def makeLookupTable(self, ticks, nPts, alpha):
+        """
+        Vectorized getColor(x, toQColor=False) at x = i / (nPts - 1), with
+        the same arithmetic so the table is identical to the one built
+        point by point. In HSV mode the interpolated h, s, v are truncated
+        to int as QColor.setHsv takes them.
+        """
+        ncol = 4 if alpha else 3
+        pos = np.array([x for t, x in ticks], dtype=np.float64)
+        colors = np.array([[t.color.red(), t.color.green(), t.color.blue(),
+                            t.color.alpha()] for t, x in ticks],
+                          dtype=np.float64)
+        if len(ticks) == 1:
+            return np.repeat(colors[:, :ncol], nPts, axis=0).astype(np.ubyte)
+        x = np.arange(nPts, dtype=np.float64) / (nPts - 1)
+        # First segment with x1 <= x <= x2, as in the loop of getColor
+        i = np.clip(np.searchsorted(pos, x, side='left'), 1, len(pos) - 1)
+        x1, x2 = pos[i - 1], pos[i]
+        dx = x2 - x1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            f = np.where(dx == 0, 0., (x - x1) / dx)
+        f = f[:, np.newaxis]
+        if self.colorMode == 'rgb':
+            table = colors[i - 1] * (1. - f) + colors[i] * f
+        else:
+            hsv = np.array([t.color.getHsv()[:3] for t, x in ticks],
+                           dtype=np.float64)
+            h, s, v = (hsv[i - 1] * (1. - f) + hsv[i] * f).T
+            r, g, b = hsv_to_rgb(h.astype(np.int64), s.astype(np.int64),
+                                 v.astype(np.int64))
+            table = np.stack([r, g, b, np.full(nPts, 255)], axis=-1)
+            table = table.astype(np.float64)
+        low = x <= pos[0]
+        high = ~low & (x >= pos[-1])
+        table[low] = colors[0]
+        table[high] = colors[-1]
+        return table[:, :ncol].astype(np.ubyte)
 
     def usesAlpha(self):
         """Return True if any ticks have an alpha < 255"""
@@ -53,6 +53,7 @@ class HistogramLUTItem(GraphicsWidget):
         """
         GraphicsWidget.__init__(self)
         self.lut = None
+        self.histogram = None
         self.imageItem = lambda: None  # fake a dead weakref
         
         self.layout = QtGui.QGraphicsGridLayout()
@@ -268,9 +269,28 @@ class HistogramLUTItem(GraphicsWidget):
         self.sigLevelsChanged.emit(self)
         self.update()
 
+    def setHistogram(self, x, y=None):
+        """Show a precomputed histogram, e.g. the cached statistics of a
+        property, instead of computing it from the linked image. Call with
+        None to compute it from the image again.
+        """
+        if x is None:
+            self.histogram = None
+            self.plot.clear()
+            if self.imageItem() is not None:
+                self.imageChanged()
+            return
+        self.histogram = (x, y)
+        self.plot.setData(x, y)
+
     def imageChanged(self, autoLevel=False, autoRange=False):
         profiler = debug.Profiler()
-        h = self.imageItem().getHistogram()
+        if self.histogram is not None:
+            h = self.histogram
+        elif self.imageItem() is not None:
+            h = self.imageItem().getHistogram()
+        else:
+            return
         profiler('get histogram')
         if h[0] is None:
             return
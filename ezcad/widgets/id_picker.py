@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Ezcad Development Team. All Rights Reserved.
+"""
+ID-buffer picking for the vispy 3D viewer.
+
+visual_at() renders the scene for picking at every click and returns
+only the visual. IdPicker keeps a hidden canvas with one picking copy of
+each displayed visual, colored by pick id (see ezcad.utils.id_buffer):
+Point vertexes as markers, Line segments and Tsurface triangles. The
+copies are made once per visual and kept, with the transform from the
+visual to the scene of the view, so a camera move only renders the id
+image again, without uploading any vertex. The image is rendered on
+demand and reused until the camera, the canvas size, a transform or the
+set of visuals changes, so clicks and hovers are one array read that
+resolves to the visual and element index.
+"""
+
+import numpy as np
+from vispy import scene
+
+from ezcad.utils.id_buffer import (IdRegistry, encode_ids, decode_rgba,
+                                   nearest_id)
+from ezcad.utils.logger import logger
+
+PICK_RADIUS = 5  # pixels
+
+# Corners of the unit cube, mapped to tell whether a transform changed.
+_PROBE = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]],
+                  dtype=np.float64)
+
+
+def _segments(pos, connect):
+    """ Start and end vertex index of each line segment """
+    n = len(pos)
+    if isinstance(connect, np.ndarray):
+        return connect.reshape(-1, 2)
+    if connect == 'segments':
+        start = np.arange(0, n - 1, 2)
+    else:  # strip
+        start = np.arange(n - 1)
+    return np.stack((start, start + 1), axis=-1)
+
+
+def _data_key(visual):
+    """ Identity of the data the picking copy of visual is made from """
+    connect = getattr(visual, 'connect', None)
+    if not isinstance(connect, str):
+        connect = id(connect)
+    return (id(getattr(visual, 'vertexes', None)),
+            id(getattr(visual, 'mesh_data', None)), connect)
+
+
+class IdPicker:
+    """Offscreen id pass of one vispy view"""
+    def __init__(self, canvas, view, marker_size=5):
+        """
+        -i- canvas : vispy SceneCanvas of the viewer
+        -i- view : vispy ViewBox of the viewer
+        -i- marker_size : float, size of point markers in the id pass
+        """
+        self.canvas = canvas
+        self.view = view
+        self.marker_size = marker_size
+        self.registry = IdRegistry()
+        self._pick_canvas = None
+        self._pick_view = None
+        self._nodes = {}  # id(visual) -> (visual, node, data key)
+        self._image = None
+        self._key = None
+        self.renders = 0
+        self.builds = 0
+
+    def invalidate(self, visual=None):
+        """
+        Make the picking copy of visual again at the next pick, e.g. after
+        editing its vertexes in place; all of them if visual is None.
+        """
+        if visual is None:
+            for item in list(self._nodes.values()):
+                self._drop(item[0])
+        else:
+            self._drop(visual)
+        self._key = None
+
+    def _drop(self, visual):
+        item = self._nodes.pop(id(visual), None)
+        if item is not None:
+            item[1].parent = None
+            self.registry.unregister(visual)
+
+    def _transform(self, visual):
+        """ Transform from visual to the scene of the view """
+        return visual.node_transform(self.view.scene)
+
+    def _view_key(self, visuals):
+        camera = self.view.camera
+        state = tuple(sorted((k, repr(v))
+                             for k, v in camera.get_state().items()))
+        items = []
+        for visual in visuals:
+            probe = self._transform(visual).map(_PROBE)
+            items.append((id(visual), bool(visual.visible),
+                          _data_key(visual), probe.tobytes()))
+        return state, tuple(self.canvas.size), tuple(items)
+
+    def _make_canvas(self):
+        self._pick_canvas = scene.SceneCanvas(size=self.canvas.size,
+                                              bgcolor=(0, 0, 0, 0),
+                                              show=False)
+        self._pick_view = self._pick_canvas.central_widget.add_view()
+        self._pick_view.camera = type(self.view.camera)()
+
+    def _make_node(self, visual):
+        """ Picking copy of visual, or None if it cannot be picked """
+        vertexes = getattr(visual, 'vertexes', None)
+        mesh = getattr(visual, 'mesh_data', None)
+        if vertexes is not None and not hasattr(visual, 'connect'):
+            pos = np.asarray(vertexes['xyz'], dtype=np.float32)
+            ids = self.registry.register(visual, len(pos))
+            node = scene.visuals.Markers()
+            if hasattr(node, 'antialias'):
+                node.antialias = 0
+            node.set_data(pos, size=self.marker_size, edge_width=0,
+                          face_color=encode_ids(ids))
+        elif vertexes is not None:
+            # Both ends of a segment get the segment id, so the color is
+            # constant along it. The element is the start vertex index.
+            pos = np.asarray(vertexes['xyz'], dtype=np.float32)
+            seg = _segments(pos, visual.connect)
+            ids = self.registry.register(visual, len(pos))
+            ids = np.repeat(ids[seg[:, 0]], 2)
+            node = scene.visuals.Line(pos=pos[seg.reshape(-1)],
+                                      color=encode_ids(ids),
+                                      connect='segments', method='gl',
+                                      antialias=False)
+        elif mesh is not None:
+            faces = mesh.get_faces()
+            ids = self.registry.register(visual, len(faces))
+            node = scene.visuals.Mesh(vertices=mesh.get_vertices(),
+                                      faces=faces,
+                                      face_colors=encode_ids(ids))
+        else:
+            return None
+        node.set_gl_state(blend=False, depth_test=True)
+        return node
+
+    def _sync_nodes(self, visuals):
+        """ Make copies of new or changed visuals, drop removed ones """
+        wanted = {id(v): v for v in visuals}
+        for key, (visual, node, data) in list(self._nodes.items()):
+            if wanted.get(key) is not visual or data != _data_key(visual):
+                self._drop(visual)
+        for key, visual in wanted.items():
+            if key in self._nodes:
+                continue
+            node = self._make_node(visual)
+            if node is None:
+                continue
+            self._pick_view.add(node)
+            self._nodes[key] = (visual, node, _data_key(visual))
+            self.builds += 1
+
+    def _render(self, visuals, key):
+        if self._pick_canvas is None:
+            self._make_canvas()
+        self._sync_nodes(visuals)
+        for visual, node, data in self._nodes.values():
+            node.visible = visual.visible
+            node.transform = self._transform(visual)
+        self._pick_canvas.size = self.canvas.size
+        self._pick_view.camera.set_state(self.view.camera.get_state())
+        image = self._pick_canvas.render(bgcolor=(0, 0, 0, 0))
+        self._image = decode_rgba(image)
+        self._key = key
+        self.renders += 1
+        logger.info('Rendered id buffer of {} visuals'.format(
+            len(self._nodes)))
+
+    def pick(self, pos, visuals, radius=PICK_RADIUS):
+        """
+        -i- pos : tuple, (x, y) pixel position of the event
+        -i- visuals : list, the displayed visuals, canvas.visuals
+        -i- radius : int, pixels around pos to look for an element
+        -o- visual : the picked visual, None if nothing is near
+        -o- element : int, vertex or triangle index in the visual
+        """
+        key = self._view_key(visuals)
+        if self._image is None or key != self._key:
+            self._render(visuals, key)
+        # The image is in physical pixels on high-DPI screens.
+        scale = self._image.shape[1] / self.canvas.size[0]
+        col, row = int(pos[0] * scale), int(pos[1] * scale)
+        r = int(np.ceil(radius * scale))
+        r0, c0 = max(row - r, 0), max(col - r, 0)
+        window = self._image[r0:row + r + 1, c0:col + r + 1]
+        pick_id = nearest_id(window, (row - r0, col - c0), r)
+        return self.registry.decode(pick_id)
+
+    def close(self):
+        if self._pick_canvas is not None:
+            self._pick_canvas.close()
+            self._pick_canvas = None
+        self._nodes = {}
+        self.registry.clear()
+        self._image = None
+        self._key = None
+
+
+def main():
+    """ Pick on a real canvas, e.g. EGL_PLATFORM=surfaceless offscreen """
+    import time
+    canvas = scene.SceneCanvas(size=(400, 300), show=False)
+    view = canvas.central_widget.add_view()
+    view.camera = 'turntable'
+    group = scene.Node(parent=view.scene)
+    group.transform = scene.transforms.STTransform(scale=(1, 1, 2))
+
+    vertexes = np.zeros(1000, dtype=[('xyz', np.float32, 3)])
+    vertexes['xyz'] = np.random.rand(1000, 3) * 10
+    points = scene.visuals.Markers(parent=group)
+    points.set_data(vertexes['xyz'])
+    points.unfreeze()
+    points.vertexes = vertexes  # as the Point objects attach them
+    line = scene.visuals.Line(parent=view.scene)
+    line.unfreeze()
+    line.vertexes = np.zeros(2, dtype=[('xyz', np.float32, 3)])
+    line.vertexes['xyz'] = [[0, 0, 0], [10, 10, 20]]
+    line.set_data(line.vertexes['xyz'], connect='strip')
+    visuals = [points, line]
+    view.camera.set_range()
+    canvas.render()  # lays out the view, as showing the viewer does
+
+    picker = IdPicker(canvas, view)
+    # The pixel of point 0 in the viewer, through its group transform.
+    tr = points.node_transform(view.scene)
+    xyz = tr.map(points.vertexes['xyz'][:1])
+    pos = view.scene.node_transform(canvas.scene).map(xyz)[0]
+    pos = pos[:2] / pos[3]
+    t0 = time.time()
+    print('Picked', picker.pick(pos, visuals), 'in {:.3f} s'.format(
+        time.time() - t0))
+    for k in range(10):
+        view.camera.azimuth += 5
+        picker.pick((200, 150), visuals)
+    print('{} copies made, {} renders after 10 camera moves'.format(
+        picker.builds, picker.renders))
+    picker.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,30 +2,21 @@
 # Copyright (c) Ezcad Development Team. All Rights Reserved.
 
 from functools import partial
-import numpy as np
 from qtpy.QtCore import Qt
 from qtpy.QtWidgets import (QLabel, QTableWidget, QTableWidgetItem,
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton)
 from ezcad.config.base import _
+from ezcad.utils.property_stats import get_stats
 
 
-def add_array_percentile(prop):
+def add_array_percentile(prop, refresh=False):
     """
     -i- prop : dict, for example cube.prop[prop]
+    -i- refresh : bool, compute the statistics again
+    Percentiles 0, 10, 50, 90 and 100, from the cached statistics.
     """
-    if 'array1d' in prop:
-        data = prop['array1d']
-    elif 'array2d' in prop:
-        data = prop['array2d']
-    elif 'array3d' in prop:
-        data = prop['array3d']
-    else:
-        raise ValueError("Unknown value")
-    ps = [0, 10, 50, 90, 100]
-    vs = []
-    for p in ps:
-        vs.append(np.percentile(data, p))
-    prop['arrayPercentiles'] = vs
+    stats = get_stats(prop, refresh=refresh)
+    prop['arrayPercentiles'] = list(stats['values'])
 
 
 def PropertyDistribtionTable(dict_prop):
@@ -45,8 +36,7 @@ def PropertyDistribtionTable(dict_prop):
     key = 'arrayPercentiles'
     for i in range(nrow):
         prop = props[i]
-        if not key in dict_prop[prop]:
-            add_array_percentile(dict_prop[prop])
+        add_array_percentile(dict_prop[prop])  # cached statistics
         p0, p10, p50, p90, p100 = dict_prop[prop][key]
         state = [prop, p0, p10, p50, p90, p100]
         state = [str(a) for a in state]  # convert to string
@@ -67,7 +57,7 @@ def refresh(table, dict_prop):
     key = 'arrayPercentiles'
     for i in range(nrow):
         prop = props[i]
-        add_array_percentile(dict_prop[prop])
+        add_array_percentile(dict_prop[prop], refresh=True)
         p0, p10, p50, p90, p100 = dict_prop[prop][key]
         state = [prop, p0, p10, p50, p90, p100]
         state = [str(a) for a in state]  # convert to string
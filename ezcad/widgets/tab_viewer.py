@@ -104,5 +104,7 @@ class TabViewer(QTabWidget):
         # print("removing tab", index)
         widget = self.widget(index)
         if widget is not None:
+            if hasattr(widget, 'close_viewer'):
+                widget.close_viewer()
             widget.deleteLater()
         self.removeTab(index)
@@ -16,7 +16,8 @@ from ezcad.utils.logger import logger
 from ezcad.utils.functions import save_display_state
 from ezcad.utils.copy_to_clipboard import copy_to_clipboard
 from ezcad.widgets.dialogs import AspectRatioDialog, CanvasExportDialog
-from ezcad.utils.convert_grid import xy2ln
+from ezcad.utils.survey_transform import get_transform
+from ezcad.utils.spatial_index import request_index
 
 
 def display_selection(fig, selected, pos):
@@ -43,12 +44,22 @@ def display_selection(fig, selected, pos):
     logger.info("Object name: {}".format(selected.name))
     if not hasattr(selected, 'vertexes'):
         return
-    index = np.where((selected.vertexes['xyz'][:,0] >= xMin) &
-                     (selected.vertexes['xyz'][:,0] <= xMax) &
-                     (selected.vertexes['xyz'][:,1] >= yMin) &
-                     (selected.vertexes['xyz'][:,1] <= yMax))
-    if len(index[0]) >= 1: # index is tuple (array,)
-        index = index[0][0]
+    index = None
+    spatial_index = request_index(selected)
+    if spatial_index is not None:
+        index = spatial_index.nearest_in_box(pos[0], pos[1],
+                                             xMin, xMax, yMin, yMax)
+    else:
+        # The index is being built in the background, scan this time.
+        xyz = selected.vertexes['xyz']
+        found = np.flatnonzero((xyz[:,0] >= xMin) & (xyz[:,0] <= xMax) &
+                               (xyz[:,1] >= yMin) & (xyz[:,1] <= yMax))
+        if len(found) >= 1:
+            dist = (xyz[found,0] - pos[0])**2 + (xyz[found,1] - pos[1])**2
+            index = found[np.argmin(dist)]
+    if index is None:
+        logger.info("No data is found near the click")
+        return
     logger.info("Data index = {}".format(index))
     for prop_name in sorted(selected.prop):
         prop = selected.prop[prop_name]
@@ -117,7 +128,7 @@ class VispyCanvas(QWidget):
             if survey is None:
                 ilno, xlno = (0, 0)
             else:
-                ilno, xlno = xy2ln(xy, survey=survey)
+                ilno, xlno = get_transform(survey).to_ln(xy)
             self.canvas.sigPickedPoint.emit((ilno, xlno, x, y, z))
 
             selected = None
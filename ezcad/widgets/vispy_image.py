@@ -20,6 +20,7 @@ from ezcad.config.main import CONF
 
 from ezcad.utils.functions import save_display_state
 from ezcad.utils.copy_to_clipboard import copy_to_clipboard
+from ezcad.utils.section_cache import get_section_cache, section_key
 from ezcad.widgets.dialogs import AspectRatioDialog, CanvasExportDialog
 
 
@@ -66,6 +67,9 @@ class VispyImage(QWidget):
     def show_help(self):
         QMessageBox.information(self, _('How to use'), self.base.HELP)
 
+    def close_viewer(self):
+        self.base.close_viewer()
+
 
 class CanvasWidget(QWidget):
     NAME = _('vispy image')
@@ -73,6 +77,10 @@ class CanvasWidget(QWidget):
 
     sig_hide_all = Signal()
     sigPickedImageIndex = Signal(tuple)
+    # Eviction callbacks of the section cache run on the thread that puts
+    # the section, e.g. a prefetch worker; the signal queues them to the
+    # GUI thread, the only one which may touch the images.
+    sigSectionEvicted = Signal(object, object)
 
     def __init__(self, parent=None, name=None):
         super(CanvasWidget, self).__init__(parent=parent)
@@ -103,6 +111,12 @@ class CanvasWidget(QWidget):
         self.aspect_method = "Auto"
         self.apply_aspect(self.aspect_method)
 
+        self.shown_section = None
+        self.section_cache = get_section_cache()
+        self.sigSectionEvicted.connect(self.section_evicted)
+        self._evicted_callback = self.sigSectionEvicted.emit
+        self.section_cache.add_callback(self._evicted_callback)
+
     def print_coord(self, point):
         logger.info("Mouse pressed at image index {}".format(point))
         self.dob.print_section_val(self.section_type, point)
@@ -257,21 +271,134 @@ class CanvasWidget(QWidget):
                     self.clear()
 
     def clear(self):
+        self.shown_section = None
         if len(self.canvas.visuals) > 0:
             self.canvas.visuals[0].parent = None
             self.canvas.visuals.pop(0)
         if len(self.canvas.visuals) != 0:
             raise ValueError("Image view is not empty")
 
+    def section_cache_key(self, dob, section_name):
+        prop_name = dob.current_property
+        prop = dob.prop.get(prop_name, {})
+        if section_name[:5] in ['iline', 'xline', 'depth']:
+            section_type = section_name[:5]
+            section_number = dob.section_number[section_type]
+        else:
+            section_type = section_name
+            section_number = None
+        return section_key(dob.name, prop_name, section_type,
+            section_number, prop.get('colorGradient'), prop.get('colorClip'))
+
+    def section_evicted(self, key, entry):
+        """
+        Release the image of this viewer when its section is evicted from
+        the section cache, unless the object has made a new one since.
+        """
+        image = entry.nodes.get(self._name)
+        if image is None or image in self.canvas.visuals:
+            # Never release the displayed image, it may also have been
+            # updated in place to show a newer section.
+            return
+        self.release_image(key, image)
+
+    def close_viewer(self):
+        """
+        Call before the viewer is deleted, e.g. by TabViewer.close_tab.
+        Stop listening to the shared section cache and release the
+        images of this viewer.
+        """
+        self.section_cache.remove_callback(self._evicted_callback)
+        self.clear()
+        for key, image in self.section_cache.discard_nodes(self._name):
+            self.release_image(key, image)
+
+    def release_image(self, key, image):
+        """ Drop image from the dob dict of the section of key """
+        if key[0] not in self.database:
+            return
+        dob = self.database[key[0]]
+        section_type = key[2]
+        if section_type in ['iline', 'xline', 'depth']:
+            images = dob.section_image[section_type]
+        else:
+            images = dob.aline_image.get(section_type, {})
+        if images.get(self._name) is image:
+            images.pop(self._name)
+            logger.info('{} released {} {}'.format(self._name, key[0],
+                                                   section_type))
+
+    def update_image(self, item):
+        """
+        Show the data of item in the displayed image instead of replacing
+        the node. The texture is reused if the shape is unchanged, and the
+        shader program is kept unless the colormap changes.
+        -i- item : vispy Image, the new image of the section
+        -o- done : bool, False if the displayed image cannot take item
+        """
+        if len(self.canvas.visuals) != 1:
+            return False
+        image = self.canvas.visuals[0]
+        if image is item:
+            return True
+        if not isinstance(image, scene.visuals.Image) or \
+                not isinstance(item, scene.visuals.Image):
+            return False
+        data, old = item._data, image._data
+        if data is None or old is None or data.ndim != old.ndim:
+            # Scalar and RGB data use different color transforms.
+            return False
+        image.set_data(data)
+        if not same_colormap(image.cmap, item.cmap):
+            image.cmap = item.cmap
+        if image.clim != item.clim:
+            image.clim = item.clim
+        if image.interpolation != item.interpolation:
+            image.interpolation = item.interpolation
+        image.transform = item.transform
+        image.update()
+        return True
+
+    def set_section_data(self, dob, section_type):
+        """
+        Show the current section of dob in the displayed image, without
+        making a new image. The data object gives the section array with
+        section_array(section_type), if it has the method.
+        -o- image : vispy Image, the displayed image, None if not updated
+        """
+        extract = getattr(dob, 'section_array', None)
+        if extract is None or len(self.canvas.visuals) != 1:
+            return None
+        image = self.canvas.visuals[0]
+        if not isinstance(image, scene.visuals.Image) or image._data is None:
+            return None
+        data = extract(section_type)
+        if data is None or data.ndim != image._data.ndim:
+            return None
+        image.set_data(data)
+        clip = dob.prop.get(dob.current_property, {}).get('colorClip')
+        if clip is not None and tuple(image.clim) != tuple(clip):
+            image.clim = clip
+        image.update()
+        return image
+
     def add_cube_section(self, dob, section_name):
         self.dob = dob
         self.section_type = section_name[:5]
         parent = self._name
+        key = self.section_cache_key(dob, section_name)
         if section_name[:5] in ['iline', 'xline', 'depth']:
             section_type = section_name[:5]
             if parent not in dob.section_image[section_type]:
-                dob.plot_image_vs(section_type, parent=parent)
-            image = dob.section_image[section_type][parent]
+                image = None
+                if self.shown_section == (dob.name, section_type):
+                    # A new number of the shown section type.
+                    image = self.set_section_data(dob, section_type)
+                if image is None:
+                    dob.plot_image_vs(section_type, parent=parent)
+                else:
+                    dob.section_image[section_type][parent] = image
+            images = dob.section_image[section_type]
             xr, yr = dob.section_image_info[section_type]["range"]
             xlabel, ylabel = dob.section_image_info[section_type]["label"]
             section_name = section_type # for save display state
@@ -279,10 +406,24 @@ class CanvasWidget(QWidget):
             section = dob.aline_section[section_name]
             if parent not in dob.aline_image[section_name]:
                 dob.plot_aline_image(section, parent=parent)
-            image = dob.aline_image[section_name][parent]
+            images = dob.aline_image[section_name]
             xr, yr = section['info']['range']
             xlabel, ylabel = section['info']['label']
-        self.add_item(image)
+        image = images[parent]
+        shown = (dob.name, section_name)
+        if self.shown_section == shown and self.update_image(image):
+            # Same section type with a new number, the displayed image
+            # now shows it and becomes the image of this viewer.
+            image = self.canvas.visuals[0]
+            images[parent] = image
+        else:
+            self.add_item(image)
+            self.shown_section = shown
+        if self.section_cache.get_node(key, parent) is not image:
+            # Moves the image from the key of the previous section.
+            data = getattr(image, '_data', None)
+            nbytes = 0 if data is None else data.nbytes
+            self.section_cache.set_node(key, parent, image, nbytes=nbytes)
         self.camera.set_range(x=xr, y=yr)
         self.canvas00.xlabel.text = xlabel
         self.canvas00.ylabel.text = ylabel
@@ -301,6 +442,12 @@ class CanvasWidget(QWidget):
                         self.clear()
 
 
+def same_colormap(cmap1, cmap2):
+    """ The GLSL of a vispy colormap holds its colors and controls """
+    return cmap1 is cmap2 or (type(cmap1) is type(cmap2) and
+                              cmap1.glsl_map == cmap2.glsl_map)
+
+
 # vispy/plot/fig.py
 # vispy/plot/plotwidget.py
 class Canvas(scene.SceneCanvas):